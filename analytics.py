@@ -1,11 +1,11 @@
 import pandas as pd
 import time
-import matplotlib.pyplot as plt
 import numpy as np
-import matplotlib.dates as mdates
 import math
-from scipy.stats import kurtosis, norm, skew
 
+import profiling
+
+@profiling.profiled('figure:leverage_analysis')
 def leverage_analysis(df, strategy_name='every_day', hedge_token='ETH', hedge_token_price='eth_fut_close'):
     import plotly.graph_objects as go
     from plotly.subplots import make_subplots
@@ -58,6 +58,7 @@ def leverage_analysis(df, strategy_name='every_day', hedge_token='ETH', hedge_to
     # Чтобы сохранить: fig.write_image(f"lev_{strategy_name}.png", width=1200, height=600)
 
 
+@profiling.profiled('figure:pnl_decompose')
 def pnl_decompose(df, resample='W', strategy_name='every_day'):
     import plotly.graph_objects as go
     from plotly.subplots import make_subplots
@@ -227,6 +228,7 @@ def pnl_decompose(df, resample='W', strategy_name='every_day'):
     # fig2.write_image(f"week_{strategy_name}.png", width=1200, height=600)
     
 
+@profiling.profiled('figure:fees_decompose')
 def fees_decompose(df, strategy_name='every_day'):
     import plotly.graph_objects as go
 
@@ -1,9 +1,462 @@
 import pandas as pd
 import time
+import itertools
 import numpy as np
 import warnings
 warnings.filterwarnings("ignore")  # Игнорировать все warnings
 
+import profiling
+
+try:
+    from numba import njit
+except ImportError:  # numba не установлена - считаем на чистом numpy
+    njit = None
+
+# Версия движка: повышать при любом изменении результатов run_strategy
+# (входит в ключ кэша run_cache)
+ENGINE_VERSION = 1
+
+# Порядок служебных колонок, которые run_strategy добавляет к входным данным
+OUTPUT_COLUMNS = [
+    'capital', 'capital_diff', 'hedge_w', 'lst_w', 'count_hedge', 'count_loop',
+    'loop_ret', 'hedge_ret', 'lst_ret', 'fund_ret', 'lst_cash', 'hedge_cash',
+    'lst_cash_end', 'hedge_cash_end', 'diff_lst', 'diff_hedge', 'lst_fees',
+    'hedge_fees', 'total_fees', 'lst_pnl', 'hedge_pnl', 'hedge_pnl_test',
+    'fund_pnl', 'free_pnl', 'total_pnl', 'cum_pnl', 'capital_dev',
+    'position_dev', 'leverage', 'strategy_ret', 'strategy_cumret',
+]
+(CAPITAL, CAPITAL_DIFF, HEDGE_W, LST_W, COUNT_HEDGE, COUNT_LOOP,
+ LOOP_RET, HEDGE_RET, LST_RET, FUND_RET, LST_CASH, HEDGE_CASH,
+ LST_CASH_END, HEDGE_CASH_END, DIFF_LST, DIFF_HEDGE, LST_FEES,
+ HEDGE_FEES, TOTAL_FEES, LST_PNL, HEDGE_PNL, HEDGE_PNL_TEST,
+ FUND_PNL, FREE_PNL, TOTAL_PNL, CUM_PNL, CAPITAL_DEV,
+ POSITION_DEV, LEVERAGE, STRATEGY_RET, STRATEGY_CUMRET) = range(len(OUTPUT_COLUMNS))
+
+# Уровни детализации результата run_strategy (параметр outputs)
+OUTPUT_LEVELS = {
+    # только доходность стратегии
+    'returns': ['strategy_ret', 'strategy_cumret'],
+    # колонки для pnl_decompose / fees_decompose
+    'pnl': ['capital', 'lst_fees', 'hedge_fees', 'total_fees', 'lst_pnl', 'hedge_pnl',
+            'fund_pnl', 'total_pnl', 'strategy_ret', 'strategy_cumret'],
+    # полный аудит: все входные и служебные колонки
+    'full': OUTPUT_COLUMNS,
+}
+
+# Коды типов стратегий для ядра (без строковых сравнений внутри цикла)
+CAP_DEV, CAP_DEV_ONLY_BUY, POS_DEV, POS_DEV_ONLY_BUY, TIME_ONLY = range(5)
+STRATEGY_CODES = {
+    'cap_dev': CAP_DEV,
+    'cap_dev_only_buy': CAP_DEV_ONLY_BUY,
+    'pos_dev': POS_DEV,
+    'pos_dev_only_buy': POS_DEV_ONLY_BUY,
+}
+
+
+def strategy_code(strategy_type):
+    # Любой другой strategy_type - ребалансировка только по времени
+    return STRATEGY_CODES.get(strategy_type, TIME_ONLY)
+
+
+def _rebalance_loop(lst, hedge, cross_mult, lst_ex, fund_ret, hedge_ret_raw, time_reb,
+                    code, deviation, fut_fees, spot_fees, capital0, cross_mult0,
+                    count_loop0, count_hedge0, cum_pnl0, capital_start, out, rows):
+    """
+    Пошаговая рекурсия стратегии по барам 1..n-1 от состояния на баре 0.
+    Колонка c пишется в строку out[rows[c]]; rows[c] = -1 - колонка не нужна.
+    Все выражения повторяют порядок операций исходного цикла на iloc,
+    поэтому результат совпадает побитово.
+    Возвращает состояние после последнего бара:
+    (count_loop, count_hedge, cum_pnl, capital).
+    """
+    n = lst.shape[0]
+    prev_loop = count_loop0
+    prev_hedge = count_hedge0
+    prev_cum = cum_pnl0
+    prev_capital = capital_start
+
+    for i in range(1, n):
+        lst_pnl = prev_loop * lst[i] * cross_mult[i] - prev_loop * lst[i-1] * cross_mult[i-1]
+        fund_pnl = prev_hedge * hedge[i-1] * fund_ret[i]
+        hedge_pnl = prev_hedge * hedge[i-1] * -hedge_ret_raw[i]
+        free_pnl = hedge_pnl + fund_pnl
+        pnl = lst_pnl + hedge_pnl + fund_pnl
+        lst_cash = prev_loop * lst[i] * cross_mult[i]
+        hedge_cash = prev_hedge * hedge[i]
+        cum = prev_cum + free_pnl
+        capital_dev = cum / capital0
+        position_dev = (lst_cash / hedge_cash) - 1
+
+        # Условие ребалансировки: по отклонению и/или по временной сетке
+        diff = 0.0
+        if code == CAP_DEV:
+            fire = abs(capital_dev) >= deviation or time_reb[i]
+        elif code == CAP_DEV_ONLY_BUY:
+            fire = capital_dev >= deviation or time_reb[i]
+        elif code == POS_DEV:
+            fire = abs(position_dev) >= deviation or time_reb[i]
+        elif code == POS_DEV_ONLY_BUY:
+            fire = position_dev >= deviation or time_reb[i]
+        else:
+            fire = time_reb[i]
+
+        if code == TIME_ONLY:
+            if fire:
+                diff = pnl / cross_mult[i] / lst[i]
+        elif fire and cum > 0:
+            diff = cum / cross_mult[i] / lst[i]
+            if (code == CAP_DEV_ONLY_BUY or code == POS_DEV_ONLY_BUY) and diff < 0:
+                diff = 0.0
+            cum = 0.0
+
+        count_loop = prev_loop + diff
+        lst_fees = abs(diff * lst[i] * cross_mult[i] * spot_fees)
+        count_hedge = count_loop * lst_ex[i]
+        diff_hedge = count_hedge - prev_hedge
+        hedge_fees = abs(diff_hedge * hedge[i] * fut_fees)
+        total_fees = lst_fees + hedge_fees
+        total_pnl = pnl - total_fees
+        capital = prev_capital + total_pnl
+        lst_cash_end = count_loop * lst[i] * cross_mult0
+
+        if rows[LST_PNL] >= 0:
+            out[rows[LST_PNL], i] = lst_pnl
+        if rows[FUND_PNL] >= 0:
+            out[rows[FUND_PNL], i] = fund_pnl
+        if rows[HEDGE_PNL] >= 0:
+            out[rows[HEDGE_PNL], i] = hedge_pnl
+        if rows[HEDGE_PNL_TEST] >= 0:
+            out[rows[HEDGE_PNL_TEST], i] = prev_hedge * hedge[i-1] - prev_hedge * hedge[i]
+        if rows[FREE_PNL] >= 0:
+            out[rows[FREE_PNL], i] = free_pnl
+        if rows[LST_CASH] >= 0:
+            out[rows[LST_CASH], i] = lst_cash
+        if rows[HEDGE_CASH] >= 0:
+            out[rows[HEDGE_CASH], i] = hedge_cash
+        if rows[CAPITAL_DEV] >= 0:
+            out[rows[CAPITAL_DEV], i] = capital_dev
+        if rows[POSITION_DEV] >= 0:
+            out[rows[POSITION_DEV], i] = position_dev
+        if rows[CUM_PNL] >= 0:
+            out[rows[CUM_PNL], i] = cum
+        if rows[DIFF_LST] >= 0:
+            out[rows[DIFF_LST], i] = diff
+        if rows[COUNT_LOOP] >= 0:
+            out[rows[COUNT_LOOP], i] = count_loop
+        if rows[LST_FEES] >= 0:
+            out[rows[LST_FEES], i] = lst_fees
+        if rows[COUNT_HEDGE] >= 0:
+            out[rows[COUNT_HEDGE], i] = count_hedge
+        if rows[DIFF_HEDGE] >= 0:
+            out[rows[DIFF_HEDGE], i] = diff_hedge
+        if rows[HEDGE_FEES] >= 0:
+            out[rows[HEDGE_FEES], i] = hedge_fees
+        if rows[TOTAL_FEES] >= 0:
+            out[rows[TOTAL_FEES], i] = total_fees
+        if rows[TOTAL_PNL] >= 0:
+            out[rows[TOTAL_PNL], i] = total_pnl
+        if rows[CAPITAL] >= 0:
+            out[rows[CAPITAL], i] = capital
+        if rows[LST_CASH_END] >= 0:
+            out[rows[LST_CASH_END], i] = lst_cash_end
+        if rows[HEDGE_CASH_END] >= 0:
+            out[rows[HEDGE_CASH_END], i] = count_hedge * hedge[i]
+        if rows[LEVERAGE] >= 0:
+            out[rows[LEVERAGE], i] = lst_cash_end / capital
+        if rows[STRATEGY_CUMRET] >= 0:
+            out[rows[STRATEGY_CUMRET], i] = capital / capital0
+        if rows[STRATEGY_RET] >= 0:
+            out[rows[STRATEGY_RET], i] = capital / prev_capital - 1
+
+        prev_loop = count_loop
+        prev_hedge = count_hedge
+        prev_cum = cum
+        prev_capital = capital
+
+    return prev_loop, prev_hedge, prev_cum, prev_capital
+
+
+# Выбор бэкенда делается один раз при импорте
+if njit is not None:
+    _rebalance_kernel = njit(cache=True, error_model='numpy')(_rebalance_loop)
+    ENGINE_BACKEND = 'numba'
+else:
+    _rebalance_kernel = _rebalance_loop
+    ENGINE_BACKEND = 'numpy'
+
+
+def _segment_fire(code, deviation, capital_dev, position_dev, time_reb):
+    # Векторный аналог условия ребалансировки из _rebalance_loop
+    if code == CAP_DEV:
+        return (np.abs(capital_dev) >= deviation) | time_reb
+    if code == CAP_DEV_ONLY_BUY:
+        return (capital_dev >= deviation) | time_reb
+    if code == POS_DEV:
+        return (np.abs(position_dev) >= deviation) | time_reb
+    if code == POS_DEV_ONLY_BUY:
+        return (position_dev >= deviation) | time_reb
+    return time_reb
+
+
+def _event_loop(lst, hedge, cross_mult, lst_ex, fund_ret, hedge_ret_raw, time_reb,
+                code, deviation, fut_fees, spot_fees, capital0, cross_mult0,
+                count_loop0, count_hedge0, cum_pnl0, capital_start, out, rows):
+    """
+    Событийный вариант _rebalance_loop с той же сигнатурой и результатом.
+
+    Между ребалансировками count_loop постоянен, поэтому бары считаются
+    векторно блоками: PnL, cum_pnl (последовательный np.add.accumulate),
+    отклонения и условие ребалансировки. Первый бар блока, где ребалансировка
+    срабатывает, считается скалярным ядром, и проход продолжается после него.
+    Порядок операций совпадает с циклом, поэтому результат побитово тот же.
+    """
+    n = lst.shape[0]
+    loop = count_loop0
+    prev_hedge = count_hedge0
+    cum = cum_pnl0
+    capital = capital_start
+    chunk = 256
+    s = 1
+    while s < n:
+        t = min(n, s + chunk)
+        i = np.arange(s, t)
+        hedge_prev = np.empty(t - s)
+        hedge_prev[0] = prev_hedge
+        hedge_prev[1:] = loop * lst_ex[s:t-1]
+
+        lst_cash = loop * lst[i] * cross_mult[i]
+        lst_pnl = lst_cash - loop * lst[i-1] * cross_mult[i-1]
+        fund_pnl = hedge_prev * hedge[i-1] * fund_ret[i]
+        hedge_pnl = hedge_prev * hedge[i-1] * -hedge_ret_raw[i]
+        free_pnl = hedge_pnl + fund_pnl
+        pnl = lst_pnl + hedge_pnl + fund_pnl
+        hedge_cash = hedge_prev * hedge[i]
+        cum_seg = np.add.accumulate(np.concatenate(([cum], free_pnl)))[1:]
+        capital_dev = cum_seg / capital0
+        position_dev = (lst_cash / hedge_cash) - 1
+
+        fire = _segment_fire(code, deviation, capital_dev, position_dev, time_reb[s:t])
+        event = fire if code == TIME_ONLY else fire & (cum_seg > 0)
+        hits = np.flatnonzero(event)
+        e = s + hits[0] if len(hits) else t
+
+        m = e - s
+        if m > 0:
+            # Бары без ребалансировки: diff = 0, count_loop не меняется
+            sl = slice(0, m)
+            count_loop = np.full(m, loop + 0.0)
+            lst_fees = np.abs(0.0 * lst[s:e] * cross_mult[s:e] * spot_fees)
+            count_hedge = count_loop * lst_ex[s:e]
+            diff_hedge = count_hedge - hedge_prev[sl]
+            hedge_fees = np.abs(diff_hedge * hedge[s:e] * fut_fees)
+            total_fees = lst_fees + hedge_fees
+            total_pnl = pnl[sl] - total_fees
+            capital_seg = np.add.accumulate(np.concatenate(([capital], total_pnl)))
+            lst_cash_end = count_loop * lst[s:e] * cross_mult0
+
+            columns = (
+                (LST_PNL, lst_pnl[sl]), (FUND_PNL, fund_pnl[sl]), (HEDGE_PNL, hedge_pnl[sl]),
+                (FREE_PNL, free_pnl[sl]), (LST_CASH, lst_cash[sl]), (HEDGE_CASH, hedge_cash[sl]),
+                (CAPITAL_DEV, capital_dev[sl]), (POSITION_DEV, position_dev[sl]), (CUM_PNL, cum_seg[sl]),
+                (COUNT_LOOP, count_loop), (LST_FEES, lst_fees), (COUNT_HEDGE, count_hedge),
+                (DIFF_HEDGE, diff_hedge), (HEDGE_FEES, hedge_fees), (TOTAL_FEES, total_fees),
+                (TOTAL_PNL, total_pnl), (CAPITAL, capital_seg[1:]), (LST_CASH_END, lst_cash_end),
+            )
+            for col, values in columns:
+                if rows[col] >= 0:
+                    out[rows[col], s:e] = values
+            if rows[DIFF_LST] >= 0:
+                out[rows[DIFF_LST], s:e] = 0.0
+            if rows[HEDGE_PNL_TEST] >= 0:
+                out[rows[HEDGE_PNL_TEST], s:e] = hedge_prev[sl] * hedge[i[sl]-1] - hedge_prev[sl] * hedge[s:e]
+            if rows[HEDGE_CASH_END] >= 0:
+                out[rows[HEDGE_CASH_END], s:e] = count_hedge * hedge[s:e]
+            if rows[LEVERAGE] >= 0:
+                out[rows[LEVERAGE], s:e] = lst_cash_end / capital_seg[1:]
+            if rows[STRATEGY_CUMRET] >= 0:
+                out[rows[STRATEGY_CUMRET], s:e] = capital_seg[1:] / capital0
+            if rows[STRATEGY_RET] >= 0:
+                out[rows[STRATEGY_RET], s:e] = capital_seg[1:] / capital_seg[:-1] - 1
+
+            prev_hedge = count_hedge[-1]
+            cum = cum_seg[m-1]
+            capital = capital_seg[-1]
+
+        if e < t:
+            # Бар ребалансировки - скалярным ядром по паре баров (e-1, e)
+            w = slice(e - 1, e + 1)
+            loop, prev_hedge, cum, capital = _rebalance_kernel(
+                lst[w], hedge[w], cross_mult[w], lst_ex[w], fund_ret[w], hedge_ret_raw[w], time_reb[w],
+                code, deviation, fut_fees, spot_fees, capital0, cross_mult0,
+                loop, prev_hedge, cum, capital, out[:, w], rows)
+            # Размер следующего блока - по длине последнего промежутка между событиями
+            chunk = min(65536, max(256, 2 * (m + 1)))
+            s = e + 1
+        else:
+            chunk = min(65536, 2 * chunk)
+            s = t
+
+    return loop, prev_hedge, cum, capital
+
+
+# Движки run_strategy: пошаговый цикл и событийный (пропуск баров без ребалансировки)
+ENGINES = {'loop': None, 'events': _event_loop}
+
+
+def _prepare_inputs(data, lst_token, lst_token_ret, hedge_token, hedge_token_ret,
+                    cross_token, funding_type, cross_ex):
+    """
+    Обрезает данные по первому валидному бару и один раз забирает
+    нужные колонки в непрерывные numpy-массивы.
+    """
+    # Находим первый не-NaN индекс
+    start_bt = data[lst_token].first_valid_index()
+    return _input_arrays(data[start_bt:], lst_token, lst_token_ret, hedge_token, hedge_token_ret,
+                         cross_token, funding_type, cross_ex)
+
+
+def _input_arrays(data, lst_token, lst_token_ret, hedge_token, hedge_token_ret,
+                  cross_token, funding_type, cross_ex):
+    def column(name):
+        return np.ascontiguousarray(data[name].to_numpy(dtype=np.float64))
+
+    inputs = {
+        'data': data,
+        'lst': column(lst_token),
+        'hedge': column(hedge_token),
+        'cross': column(cross_token),
+        'funding': column(funding_type),
+        'lst_ret_raw': column(lst_token_ret),
+        'hedge_ret_raw': column(hedge_token_ret),
+    }
+    inputs['cross_mult'] = np.maximum(1, (cross_ex * inputs['cross']))
+    inputs['lst_ex'] = inputs['lst'] * inputs['cross_mult'] / inputs['hedge']
+    return inputs
+
+
+def _time_rebalance_mask(index, rebalance_hours, start_hour):
+    if rebalance_hours is None:
+        return np.zeros(len(index), dtype=bool)
+    # Получаем час из индекса (предполагается DatetimeIndex)
+    current_hour = np.asarray(index.hour)
+    # Проверяем, попадает ли текущий час в сетку: start_hour, start_hour + N, start_hour + 2N...
+    return ((current_hour - start_hour) % rebalance_hours == 0)
+
+
+def _output_columns(outputs):
+    """Список колонок для уровня outputs или явного списка колонок."""
+    if isinstance(outputs, str):
+        if outputs not in OUTPUT_LEVELS:
+            raise ValueError(f"Unknown outputs level '{outputs}', expected one of {list(OUTPUT_LEVELS)}")
+        return OUTPUT_LEVELS[outputs]
+    unknown = [c for c in outputs if c not in OUTPUT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown output columns: {unknown}")
+    return [c for c in OUTPUT_COLUMNS if c in outputs]
+
+
+def _simulate(inputs, columns, strategy_type, deviation, init_capital, fut_fees, spot_fees,
+              lst_collateral, rebalance_hours, start_hour, cross_ex, state=None, engine='loop'):
+    """
+    Прогон стратегии по блоку входных массивов.
+
+    state=None - старт с нуля: бар 0 - начальная позиция.
+    Иначе бар 0 - последний уже посчитанный бар, а state - состояние после
+    него (см. LiveStrategy); строка 0 результата тогда не используется.
+    Возвращает (out, state): out - массив (колонки x бары), state - состояние
+    после последнего бара.
+    engine - 'loop' (ядро по каждому бару) или 'events' (см. _event_loop).
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', expected one of {list(ENGINES)}")
+    kernel = ENGINES[engine] or _rebalance_kernel
+    lst = inputs['lst']
+    hedge = inputs['hedge']
+    cross_mult = inputs['cross_mult']
+    lst_ex = inputs['lst_ex']
+    n = len(lst)
+
+    hedge_w = 0.2
+    lst_w = 1 - hedge_w
+    loop_w = lst_w + ((1 - lst_w) * lst_collateral)
+    fund_ret = np.zeros(n, dtype=np.float64)
+    fund_ret[1:] = inputs['funding'][1:] * hedge_w * (loop_w / hedge_w)
+
+    # Предвыделяем только нужные колонки одним блоком (колонка = строка массива)
+    rows = np.full(len(OUTPUT_COLUMNS), -1, dtype=np.int64)
+    for row, col in enumerate(columns):
+        rows[OUTPUT_COLUMNS.index(col)] = row
+    # При профилировании diff_lst нужен для подсчета ребалансировок - временная строка
+    count_rebalances = profiling.active() is not None
+    extra = 1 if count_rebalances and rows[DIFF_LST] < 0 else 0
+    if extra:
+        rows[DIFF_LST] = len(columns)
+
+    def fill(col, values, start=0, stop=None):
+        if rows[col] >= 0:
+            out[rows[col], start:stop] = values
+
+    with profiling.phase('column_init'):
+        out = np.zeros((len(columns) + extra, n), dtype=np.float64)
+        fill(CAPITAL, init_capital)
+        fill(HEDGE_W, hedge_w)
+        fill(LST_W, lst_w)
+        # Доходности ног не зависят от состояния стратегии и считаются векторно
+        fill(LOOP_RET, inputs['lst_ret_raw'][1:], 1)
+        fill(FUND_RET, fund_ret[1:], 1)
+        fill(HEDGE_RET, -inputs['hedge_ret_raw'][1:] * hedge_w * (loop_w / hedge_w), 1)
+        fill(LST_RET, inputs['lst_ret_raw'][1:] * loop_w, 1)
+
+        # === Определение моментов временной ребалансировки ===
+        time_reb = _time_rebalance_mask(inputs['data'].index, rebalance_hours, start_hour)
+
+    if n == 0:
+        return out[:len(columns)], state
+
+    if state is None:
+        # Начальная позиция
+        count_hedge0 = init_capital * (hedge_w * ((lst_w + ((1 - lst_w) * lst_collateral)) / hedge_w)) / hedge[0]
+        count_loop0 = init_capital * ((lst_w + ((1 - lst_w) * lst_collateral))) / cross_mult[0] / lst[0]
+        lst_cash0 = count_loop0 * lst[0] * cross_mult[0]
+        lst_fees0 = init_capital * spot_fees + init_capital * (max(0, cross_ex) * spot_fees)
+        hedge_fees0 = init_capital * fut_fees
+        fill(COUNT_HEDGE, count_hedge0, 0, 1)
+        fill(COUNT_LOOP, count_loop0, 0, 1)
+        fill(LST_CASH, lst_cash0, 0, 1)
+        fill(HEDGE_CASH, count_hedge0 * hedge[0], 0, 1)
+        fill(STRATEGY_CUMRET, 1, 0, 1)
+        fill(LEVERAGE, lst_cash0 / init_capital, 0, 1)
+        fill(LST_FEES, lst_fees0, 0, 1)
+        fill(HEDGE_FEES, hedge_fees0, 0, 1)
+        fill(TOTAL_FEES, lst_fees0 + hedge_fees0, 0, 1)
+        state = {'count_loop': count_loop0, 'count_hedge': count_hedge0, 'cum_pnl': 0.0,
+                 'capital': float(init_capital), 'cross_mult0': cross_mult[0]}
+
+    with profiling.phase('main_loop'), np.errstate(all='ignore'):
+        count_loop, count_hedge, cum_pnl, capital = kernel(
+            lst, hedge, cross_mult, lst_ex, fund_ret, inputs['hedge_ret_raw'], time_reb,
+            strategy_code(strategy_type), float(deviation), float(fut_fees),
+            float(spot_fees), float(init_capital), state['cross_mult0'],
+            state['count_loop'], state['count_hedge'], state['cum_pnl'], state['capital'], out, rows)
+    state = dict(state, count_loop=count_loop, count_hedge=count_hedge, cum_pnl=cum_pnl, capital=capital)
+    if count_rebalances:
+        diff = out[rows[DIFF_LST], 1:]
+        profiling.count(f'rebalances[{strategy_type}]', int(((diff > 0) | (diff < 0)).sum()))
+        profiling.count(f'bars[{strategy_type}]', n - 1)
+    return out[:len(columns)], state
+
+
+def _result_frame(data, lst_token, lst_ex, out, columns):
+    block = pd.DataFrame(out.T, index=data.index, columns=columns)
+    if columns is OUTPUT_COLUMNS:
+        # Полный аудит: входные колонки + служебные, как раньше
+        result = data.drop(columns=[c for c in OUTPUT_COLUMNS if c in data.columns])
+        result = result.assign(**{f'{lst_token}_ex': lst_ex})
+        block = pd.concat([result, block], axis=1)
+    block.attrs['engine_backend'] = ENGINE_BACKEND
+    return block
+
+
 def run_strategy(
     data, 
     lst_token, 
@@ -20,149 +473,266 @@ def run_strategy(
     lst_collateral=1,
     rebalance_hours=None,   # None = только по отклонению; число = каждые N часов
     start_hour=0,
-    cross_ex = 0          # Час, с которого начинается цикл (например 12:00)
+    cross_ex = 0,         # Час, с которого начинается цикл (например 12:00)
+    outputs='full',       # 'returns' / 'pnl' / 'full' или список колонок (см. OUTPUT_LEVELS)
+    engine='loop'         # 'events' - векторно между ребалансировками (для редких ребалансировок)
 ):
-    # Создаем копию данных, чтобы не изменять оригинальный датафрейм
-    data = data.copy()
-    
-    # Находим первый не-NaN индекс
-    start_bt = data[lst_token].first_valid_index()
-    data = data[start_bt:]
-    data[f'{lst_token}_ex'] = data[lst_token] * (np.maximum(1, (cross_ex * data[cross_token]))) / data[hedge_token]
-    init_capital = init_capital
-    fut_fees = fut_fees
-    spot_fees = spot_fees
-    data['capital'] = init_capital
-    data['capital_diff'] = 0
-    data['hedge_w'] = 0.2
-    data['lst_w'] = 1 - data['hedge_w']
-    data['count_hedge'] = 0 
-    data['count_loop'] = 0 
-    data['loop_ret'] = 0
-    data['hedge_ret'] = 0
-    data['lst_ret'] = 0 
-    data['fund_ret'] = 0 
-    data['lst_cash'] = 0
-    data['hedge_cash'] = 0
-    data['lst_cash_end'] = 0
-    data['hedge_cash_end'] = 0
-    data['diff_lst'] = 0
-    data['diff_hedge'] = 0
-    data['lst_fees'] = 0
-    data['hedge_fees'] = 0
-    data['total_fees'] = 0
-    data['lst_pnl'] = 0
-    data['hedge_pnl'] = 0
-    data['hedge_pnl_test'] = 0
-    data['fund_pnl'] = 0
-    data['free_pnl'] = 0
-    data['total_pnl'] = 0
-    data['cum_pnl'] = 0
-    data['capital_dev'] = 0
-    data['position_dev'] = 0
-    data['leverage'] = 0
-    data['strategy_ret'] = 0
-    data['strategy_cumret'] = 0
-
-    data.iloc[0, data.columns.get_loc('capital')] = init_capital
-    data.iloc[0, data.columns.get_loc('count_hedge')] = init_capital * (data.iloc[0, data.columns.get_loc('hedge_w')] * ((data.iloc[0, data.columns.get_loc('lst_w')] + ((1 - data.iloc[0, data.columns.get_loc('lst_w')]) * lst_collateral)) / data.iloc[0, data.columns.get_loc('hedge_w')])) / data.iloc[0, data.columns.get_loc(hedge_token)]
-    data.iloc[0, data.columns.get_loc('count_loop')] = init_capital * ((data.iloc[0, data.columns.get_loc('lst_w')] + ((1 - data.iloc[0, data.columns.get_loc('lst_w')]) * lst_collateral))) / (np.maximum(1, (cross_ex * data.iloc[0, data.columns.get_loc(cross_token)]))) / data.iloc[0, data.columns.get_loc(lst_token)]
-    data.iloc[0, data.columns.get_loc('lst_cash')] = data.iloc[0, data.columns.get_loc('count_loop')] * data.iloc[0, data.columns.get_loc(lst_token)] * (np.maximum(1, (cross_ex * data.iloc[0, data.columns.get_loc(cross_token)])))
-    data.iloc[0, data.columns.get_loc('hedge_cash')] = data.iloc[0, data.columns.get_loc('count_hedge')] * data.iloc[0, data.columns.get_loc(hedge_token)]
-    data.iloc[0, data.columns.get_loc('strategy_ret')] = 0
-    data.iloc[0, data.columns.get_loc('strategy_cumret')] = 1
-    data.iloc[0, data.columns.get_loc('leverage')] = data.iloc[0, data.columns.get_loc('lst_cash')] / data.iloc[0, data.columns.get_loc('capital')]
-    data.iloc[0, data.columns.get_loc('lst_fees')] = init_capital * spot_fees + init_capital * (max(0,cross_ex) * spot_fees)
-    data.iloc[0, data.columns.get_loc('hedge_fees')] = init_capital * fut_fees
-    data.iloc[0, data.columns.get_loc('total_fees')] = data.iloc[0, data.columns.get_loc('lst_fees')] + data.iloc[0, data.columns.get_loc('hedge_fees')]
-
-    # === ДОБАВЛЕНО: Определение моментов временной ребалансировки ===
-    if rebalance_hours is not None:
-        # Получаем час из индекса (предполагается DatetimeIndex)
-        current_hour = data.index.hour
-        # Проверяем, попадает ли текущий час в сетку: start_hour, start_hour + N, start_hour + 2N...
-        time_rebalance_condition = ((current_hour - start_hour) % rebalance_hours == 0)
+    with profiling.phase('run_strategy'):
+        columns = _output_columns(outputs)
+        with profiling.phase('data_copy'):
+            inputs = _prepare_inputs(data, lst_token, lst_token_ret, hedge_token, hedge_token_ret,
+                                     cross_token, funding_type, cross_ex)
+        out, _ = _simulate(inputs, columns, strategy_type, deviation, init_capital, fut_fees, spot_fees,
+                           lst_collateral, rebalance_hours, start_hour, cross_ex, engine=engine)
+        with profiling.phase('result_frame'):
+            return _result_frame(inputs['data'], lst_token, inputs['lst_ex'], out, columns)
+
+
+class LiveStrategy:
+    """
+    Инкрементальный режим run_strategy для ежечасного обновления.
+
+    Хранит состояние после последнего бара (count_loop, count_hedge, cum_pnl,
+    capital и последний бар входных данных). update(new_rows) считает только
+    новые бары тем же ядром, поэтому результат совпадает с полным
+    перезапуском run_strategy на всей истории побитово.
+
+        live = LiveStrategy(history, **params)
+        live.update(new_rows)   # -> DataFrame только по новым барам
+        live.result             # вся история
+    """
+
+    def __init__(self, data, lst_token, lst_token_ret, hedge_token, hedge_token_ret, cross_token,
+                 funding_type, strategy_type, deviation, init_capital, fut_fees, spot_fees,
+                 lst_collateral=1, rebalance_hours=None, start_hour=0, cross_ex=0, outputs='full'):
+        self.tokens = (lst_token, lst_token_ret, hedge_token, hedge_token_ret, cross_token, funding_type)
+        self.params = dict(strategy_type=strategy_type, deviation=deviation, init_capital=init_capital,
+                           fut_fees=fut_fees, spot_fees=spot_fees, lst_collateral=lst_collateral,
+                           rebalance_hours=rebalance_hours, start_hour=start_hour, cross_ex=cross_ex)
+        self.columns = _output_columns(outputs)
+        self.state = None
+        self._chunks = []
+        self._result = None
+        if data[lst_token].first_valid_index() is None:
+            raise ValueError(f'No valid {lst_token} bars to start from')
+        self._append(_prepare_inputs(data, *self.tokens, cross_ex))
+
+    def _append(self, inputs):
+        continuing = self.state is not None
+        out, self.state = _simulate(inputs, self.columns, state=self.state, **self.params)
+        frame = _result_frame(inputs['data'], self.tokens[0], inputs['lst_ex'], out, self.columns)
+        if continuing:
+            # Бар 0 - последний уже посчитанный бар, его строка не нужна
+            frame = frame.iloc[1:]
+        self._last = inputs['data'].iloc[-1:]
+        self._chunks.append(frame)
+        self._result = None
+        return frame
+
+    def update(self, new_rows):
+        """
+        Добавляет новые бары (индекс строго после последнего посчитанного)
+        и возвращает результат только по ним. Стоимость - O(len(new_rows)).
+        """
+        if len(new_rows) and new_rows.index[0] <= self._last.index[-1]:
+            raise ValueError('new_rows must start after the last simulated bar')
+        block = pd.concat([self._last, new_rows[self._last.columns]])
+        return self._append(_input_arrays(block, *self.tokens, self.params['cross_ex']))
+
+    @property
+    def result(self):
+        """Результат по всей истории (как run_strategy на всех данных)."""
+        if self._result is None:
+            # Склеиваем накопленные куски один раз при обращении
+            if len(self._chunks) > 1:
+                self._chunks = [pd.concat(self._chunks)]
+            self._result = self._chunks[0]
+        return self._result
+
+
+def config_name(strategy_type, deviation=None, rebalance_hours=None, start_hour=0):
+    """
+    Имя конфигурации в формате колонок sl_returns.xlsx:
+    cap_dev_dev0.005_reb1, pos_dev_only_buy_dev0.01_reb24, time_reb12 ...
+    """
+    if strategy_code(strategy_type) == TIME_ONLY:
+        name = 'time'
     else:
-        time_rebalance_condition = [False] * len(data)
-
-    for i in range(1, len(data)):
-        data.iloc[i, data.columns.get_loc('loop_ret')] = (data.iloc[i, data.columns.get_loc(lst_token_ret)])
-        data.iloc[i, data.columns.get_loc('fund_ret')] = data.iloc[i, data.columns.get_loc(funding_type)] * data.iloc[i, data.columns.get_loc('hedge_w')] * ((data.iloc[i, data.columns.get_loc('lst_w')] + ((1 - data.iloc[i, data.columns.get_loc('lst_w')]) * lst_collateral)) / data.iloc[i, data.columns.get_loc('hedge_w')])
-        data.iloc[i, data.columns.get_loc('hedge_ret')] = -data.iloc[i, data.columns.get_loc(hedge_token_ret)] * data.iloc[i, data.columns.get_loc('hedge_w')] * ((data.iloc[i, data.columns.get_loc('lst_w')] + ((1 - data.iloc[i, data.columns.get_loc('lst_w')]) * lst_collateral)) / data.iloc[i, data.columns.get_loc('hedge_w')])
-        data.iloc[i, data.columns.get_loc('lst_ret')] = data.iloc[i, data.columns.get_loc('loop_ret')] * (data.iloc[i, data.columns.get_loc('lst_w')] + ((1 - data.iloc[i, data.columns.get_loc('lst_w')]) * lst_collateral))
-        data.iloc[i, data.columns.get_loc('lst_pnl')] = data.iloc[i-1, data.columns.get_loc('count_loop')] * data.iloc[i, data.columns.get_loc(lst_token)] * (np.maximum(1, (cross_ex * data.iloc[i, data.columns.get_loc(cross_token)]))) - data.iloc[i-1, data.columns.get_loc('count_loop')] * data.iloc[i-1, data.columns.get_loc(lst_token)] * (np.maximum(1, (cross_ex * data.iloc[i-1, data.columns.get_loc(cross_token)])))
-        data.iloc[i, data.columns.get_loc('fund_pnl')] = data.iloc[i-1, data.columns.get_loc('count_hedge')] * data.iloc[i-1, data.columns.get_loc(hedge_token)] * data.iloc[i, data.columns.get_loc('fund_ret')]
-        data.iloc[i, data.columns.get_loc('hedge_pnl')] = data.iloc[i-1, data.columns.get_loc('count_hedge')] * data.iloc[i-1, data.columns.get_loc(hedge_token)] * -data.iloc[i, data.columns.get_loc(hedge_token_ret)]
-        data.iloc[i, data.columns.get_loc('hedge_pnl_test')] = data.iloc[i-1, data.columns.get_loc('count_hedge')] * data.iloc[i-1, data.columns.get_loc(hedge_token)] - data.iloc[i-1, data.columns.get_loc('count_hedge')] * data.iloc[i, data.columns.get_loc(hedge_token)]
-        data.iloc[i, data.columns.get_loc('free_pnl')] = data.iloc[i, data.columns.get_loc('hedge_pnl')] + data.iloc[i, data.columns.get_loc('fund_pnl')]
-        data.iloc[i, data.columns.get_loc('total_pnl')] = data.iloc[i, data.columns.get_loc('lst_pnl')] + data.iloc[i, data.columns.get_loc('hedge_pnl')] + data.iloc[i, data.columns.get_loc('fund_pnl')]
-        data.iloc[i, data.columns.get_loc('lst_cash')] = data.iloc[i-1, data.columns.get_loc('count_loop')] * data.iloc[i, data.columns.get_loc(lst_token)] * (np.maximum(1, (cross_ex * data.iloc[i, data.columns.get_loc(cross_token)])))
-        data.iloc[i, data.columns.get_loc('hedge_cash')] = data.iloc[i-1, data.columns.get_loc('count_hedge')] * data.iloc[i, data.columns.get_loc(hedge_token)]     
-        data.iloc[i, data.columns.get_loc('cum_pnl')] = data.iloc[i-1, data.columns.get_loc('cum_pnl')] + data.iloc[i, data.columns.get_loc('free_pnl')]
-        data.iloc[i, data.columns.get_loc('capital_dev')] = data.iloc[i, data.columns.get_loc('cum_pnl')] / data.iloc[0, data.columns.get_loc('capital')]
-        data.iloc[i, data.columns.get_loc('position_dev')] = (data.iloc[i, data.columns.get_loc('lst_cash')] / data.iloc[i, data.columns.get_loc('hedge_cash')])-1
-
-        # === МОДИФИЦИРОВАНО: Условие ребалансировки ===
-        should_rebalance_by_time = rebalance_hours is not None and time_rebalance_condition[i]
-
-        if strategy_type == 'cap_dev':
-            should_rebalance = abs(data.iloc[i, data.columns.get_loc('capital_dev')]) >= deviation or should_rebalance_by_time
-            if should_rebalance:
-                if data.iloc[i, data.columns.get_loc('cum_pnl')] > 0:
-                    data.iloc[i, data.columns.get_loc('diff_lst')] = data.iloc[i, data.columns.get_loc('cum_pnl')] / (np.maximum(1, (cross_ex * data.iloc[i, data.columns.get_loc(cross_token)]))) / data.iloc[i, data.columns.get_loc(lst_token)]
-                    data.iloc[i, data.columns.get_loc('cum_pnl')] = 0
-                else:
-                    data.iloc[i, data.columns.get_loc('diff_lst')] = 0
-            else:
-                data.iloc[i, data.columns.get_loc('diff_lst')] = 0
-
-        elif strategy_type == 'cap_dev_only_buy':
-            should_rebalance = (data.iloc[i, data.columns.get_loc('capital_dev')] >= deviation or should_rebalance_by_time) and data.iloc[i, data.columns.get_loc('cum_pnl')] > 0
-            if should_rebalance:
-                data.iloc[i, data.columns.get_loc('diff_lst')] = data.iloc[i, data.columns.get_loc('cum_pnl')] / (np.maximum(1, (cross_ex * data.iloc[i, data.columns.get_loc(cross_token)]))) / data.iloc[i, data.columns.get_loc(lst_token)]
-                if data.iloc[i, data.columns.get_loc('diff_lst')] < 0:
-                    data.iloc[i, data.columns.get_loc('diff_lst')] = 0
-                data.iloc[i, data.columns.get_loc('cum_pnl')] = 0
-            else:
-                data.iloc[i, data.columns.get_loc('diff_lst')] = 0
-
-        elif strategy_type == 'pos_dev':
-            should_rebalance = abs(data.iloc[i, data.columns.get_loc('position_dev')]) >= deviation or should_rebalance_by_time
-            if should_rebalance:
-                if data.iloc[i, data.columns.get_loc('cum_pnl')] > 0:
-                    data.iloc[i, data.columns.get_loc('diff_lst')] = data.iloc[i, data.columns.get_loc('cum_pnl')] / (np.maximum(1, (cross_ex * data.iloc[i, data.columns.get_loc(cross_token)]))) / data.iloc[i, data.columns.get_loc(lst_token)]
-                    data.iloc[i, data.columns.get_loc('cum_pnl')] = 0
-                else:
-                    data.iloc[i, data.columns.get_loc('diff_lst')] = 0
-            else:
-                data.iloc[i, data.columns.get_loc('diff_lst')] = 0
-
-        elif strategy_type == 'pos_dev_only_buy':
-            should_rebalance = (data.iloc[i, data.columns.get_loc('position_dev')] >= deviation or should_rebalance_by_time) and data.iloc[i, data.columns.get_loc('cum_pnl')] > 0
-            if should_rebalance:
-                data.iloc[i, data.columns.get_loc('diff_lst')] = data.iloc[i, data.columns.get_loc('cum_pnl')] / (np.maximum(1, (cross_ex * data.iloc[i, data.columns.get_loc(cross_token)]))) / data.iloc[i, data.columns.get_loc(lst_token)]
-                if data.iloc[i, data.columns.get_loc('diff_lst')] < 0:
-                    data.iloc[i, data.columns.get_loc('diff_lst')] = 0
-                data.iloc[i, data.columns.get_loc('cum_pnl')] = 0
+        name = f'{strategy_type}_dev{deviation}'
+    if rebalance_hours is not None:
+        name += f'_reb{rebalance_hours}'
+    if start_hour:
+        name += f'_start{start_hour}'
+    return name
+
+
+def expand_grid(grid):
+    """
+    Разворачивает сетку параметров в список конфигураций.
+
+    grid - словарь списков {'strategy_type': [...], 'deviation': [...],
+           'rebalance_hours': [...], 'start_hour': [...]} (декартово произведение)
+           или готовый список словарей с теми же ключами.
+    Для стратегий только по времени deviation не важен, дубликаты отбрасываются.
+    """
+    if isinstance(grid, dict):
+        keys = ['strategy_type', 'deviation', 'rebalance_hours', 'start_hour']
+        values = [list(grid.get('strategy_type', [])),
+                  list(grid.get('deviation', [0])),
+                  list(grid.get('rebalance_hours', [None])),
+                  list(grid.get('start_hour', [0]))]
+        grid = [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+    configs = {}
+    for params in grid:
+        params = {
+            'strategy_type': params['strategy_type'],
+            'deviation': params.get('deviation', 0),
+            'rebalance_hours': params.get('rebalance_hours'),
+            'start_hour': params.get('start_hour', 0),
+        }
+        name = config_name(**params)
+        if name not in configs:
+            configs[name] = dict(params, name=name)
+    return list(configs.values())
+
+
+def _simulate_batch(inputs, codes, deviations, time_reb, init_capital, fut_fees, spot_fees,
+                    lst_collateral, cross_ex, aggregates=False):
+    """
+    Та же рекурсия, что и в _rebalance_loop, но для K прогонов сразу:
+    состояние - массивы формы (K,), которые продвигаются вместе по барам.
+
+    Входные ряды inputs и time_reb - формы (n,) (общие для всех прогонов,
+    как в run_grid) или (n, K) (свой ряд у каждого прогона, как у
+    траекторий stress).
+    Возвращает матрицу strategy_ret формы (n, K), а при aggregates=True -
+    итоги прогона вместо нее: словарь массивов (K,) final_capital,
+    max_drawdown, peak_leverage, total_fees, rebalances.
+    """
+    lst = inputs['lst']
+    hedge = inputs['hedge']
+    cross_mult = inputs['cross_mult']
+    lst_ex = inputs['lst_ex']
+    hedge_ret_raw = inputs['hedge_ret_raw']
+    n = len(lst)
+    k = len(codes)
+
+    hedge_w = 0.2
+    lst_w = 1 - hedge_w
+    loop_w = lst_w + ((1 - lst_w) * lst_collateral)
+    fund_ret = inputs['funding'] * hedge_w * (loop_w / hedge_w)
+
+    is_time = codes == TIME_ONLY
+    is_cap = (codes == CAP_DEV) | (codes == CAP_DEV_ONLY_BUY)
+    only_buy = (codes == CAP_DEV_ONLY_BUY) | (codes == POS_DEV_ONLY_BUY)
+
+    strategy_ret = None if aggregates else np.zeros((n, k), dtype=np.float64)
+    if n == 0:
+        return strategy_ret
+
+    capital0 = np.full(k, init_capital, dtype=np.float64)
+    capital = capital0.copy()
+    count_hedge = np.full(k, init_capital * (hedge_w * ((lst_w + ((1 - lst_w) * lst_collateral)) / hedge_w)) / hedge[0])
+    count_loop = np.full(k, init_capital * ((lst_w + ((1 - lst_w) * lst_collateral))) / cross_mult[0] / lst[0])
+    cum = np.zeros(k, dtype=np.float64)
+    if aggregates:
+        # Итоги считаются так же, как колонки run_strategy (с начальными комиссиями бара 0)
+        fees = np.full(k, init_capital * spot_fees + init_capital * (max(0, cross_ex) * spot_fees)
+                       + init_capital * fut_fees)
+        peak = capital.copy()
+        max_drawdown = np.zeros(k, dtype=np.float64)
+        peak_leverage = count_loop * lst[0] * cross_mult[0] / init_capital
+        rebalances = np.zeros(k, dtype=np.int64)
+
+    with np.errstate(all='ignore'):
+        for i in range(1, n):
+            lst_pnl = count_loop * lst[i] * cross_mult[i] - count_loop * lst[i-1] * cross_mult[i-1]
+            fund_pnl = count_hedge * hedge[i-1] * fund_ret[i]
+            hedge_pnl = count_hedge * hedge[i-1] * -hedge_ret_raw[i]
+            free_pnl = hedge_pnl + fund_pnl
+            pnl = lst_pnl + hedge_pnl + fund_pnl
+            cum = cum + free_pnl
+            capital_dev = cum / capital0
+            position_dev = ((count_loop * lst[i] * cross_mult[i]) / (count_hedge * hedge[i])) - 1
+
+            # Условие ребалансировки для каждой конфигурации
+            dev = np.where(is_cap, capital_dev, position_dev)
+            dev = np.where(only_buy, dev, np.abs(dev))
+            fire = np.where(is_time, time_reb[i], (dev >= deviations) | time_reb[i])
+            buy = fire & (cum > 0) & ~is_time
+
+            diff_dev = cum / cross_mult[i] / lst[i]
+            diff_dev = np.where(only_buy & (diff_dev < 0), 0.0, diff_dev)
+            diff = np.where(buy, diff_dev, 0.0)
+            diff = np.where(is_time & fire, pnl / cross_mult[i] / lst[i], diff)
+            cum = np.where(buy, 0.0, cum)
+
+            new_loop = count_loop + diff
+            lst_fees = np.abs(diff * lst[i] * cross_mult[i] * spot_fees)
+            new_hedge = new_loop * lst_ex[i]
+            hedge_fees = np.abs((new_hedge - count_hedge) * hedge[i] * fut_fees)
+            total_pnl = pnl - (lst_fees + hedge_fees)
+            new_capital = capital + total_pnl
+            if aggregates:
+                fees += lst_fees + hedge_fees
+                peak = np.maximum(peak, new_capital)
+                max_drawdown = np.maximum(max_drawdown, (peak - new_capital) / peak)
+                peak_leverage = np.maximum(peak_leverage, new_loop * lst[i] * cross_mult[0] / new_capital)
+                rebalances += np.where(is_time, fire, buy)
             else:
-                data.iloc[i, data.columns.get_loc('diff_lst')] = 0
-        else:
-            should_rebalance = should_rebalance_by_time
-            if should_rebalance:
-                data.iloc[i, data.columns.get_loc('diff_lst')] = data.iloc[i, data.columns.get_loc('total_pnl')] / (np.maximum(1, (cross_ex * data.iloc[i, data.columns.get_loc(cross_token)]))) / data.iloc[i, data.columns.get_loc(lst_token)]
-
-        data.iloc[i, data.columns.get_loc('count_loop')] = data.iloc[i-1, data.columns.get_loc('count_loop')] + data.iloc[i, data.columns.get_loc('diff_lst')]
-        data.iloc[i, data.columns.get_loc('lst_fees')] = abs(data.iloc[i, data.columns.get_loc('diff_lst')] * data.iloc[i, data.columns.get_loc(lst_token)] * (np.maximum(1, (cross_ex * data.iloc[i, data.columns.get_loc(cross_token)]))) * spot_fees)
-        data.iloc[i, data.columns.get_loc('count_hedge')] = data.iloc[i, data.columns.get_loc('count_loop')] * data.iloc[i, data.columns.get_loc(f'{lst_token}_ex')]
-        data.iloc[i, data.columns.get_loc('diff_hedge')] = data.iloc[i, data.columns.get_loc('count_hedge')] - data.iloc[i-1, data.columns.get_loc('count_hedge')]
-        data.iloc[i, data.columns.get_loc('hedge_fees')] = abs(data.iloc[i, data.columns.get_loc('diff_hedge')] * data.iloc[i, data.columns.get_loc(hedge_token)] * fut_fees)
-        data.iloc[i, data.columns.get_loc('total_fees')] = data.iloc[i, data.columns.get_loc('lst_fees')] + data.iloc[i, data.columns.get_loc('hedge_fees')]
-        data.iloc[i, data.columns.get_loc('total_pnl')] = data.iloc[i, data.columns.get_loc('total_pnl')] - data.iloc[i, data.columns.get_loc('total_fees')]
-        data.iloc[i, data.columns.get_loc('capital')] = data.iloc[i-1, data.columns.get_loc('capital')] + data.iloc[i, data.columns.get_loc('total_pnl')]
-        data.iloc[i, data.columns.get_loc('lst_cash_end')] = data.iloc[i, data.columns.get_loc('count_loop')] * data.iloc[i, data.columns.get_loc(lst_token)] * (np.maximum(1, (cross_ex * data.iloc[0, data.columns.get_loc(cross_token)])))
-        data.iloc[i, data.columns.get_loc('hedge_cash_end')] = data.iloc[i, data.columns.get_loc('count_hedge')] * data.iloc[i, data.columns.get_loc(hedge_token)] 
-        data.iloc[i, data.columns.get_loc('leverage')] = data.iloc[i, data.columns.get_loc('lst_cash_end')] / data.iloc[i, data.columns.get_loc('capital')]
-        data.iloc[i, data.columns.get_loc('strategy_cumret')] = data.iloc[i, data.columns.get_loc('capital')] / data.iloc[0, data.columns.get_loc('capital')]
-        data.iloc[i, data.columns.get_loc('strategy_ret')] = data.iloc[i, data.columns.get_loc('capital')] / data.iloc[i-1, data.columns.get_loc('capital')] - 1
-    
-    return data
+                strategy_ret[i] = new_capital / capital - 1
+
+            count_loop = new_loop
+            count_hedge = new_hedge
+            capital = new_capital
+
+    if aggregates:
+        return {'final_capital': capital, 'max_drawdown': max_drawdown, 'peak_leverage': peak_leverage,
+                'total_fees': fees, 'rebalances': rebalances}
+    return strategy_ret
+
+
+@profiling.profiled('run_grid')
+def run_grid(
+    data,
+    grid,
+    lst_token,
+    lst_token_ret,
+    hedge_token,
+    hedge_token_ret,
+    cross_token,
+    funding_type,
+    init_capital,
+    fut_fees,
+    spot_fees,
+    lst_collateral=1,
+    cross_ex=0
+):
+    """
+    Прогон сетки параметров (strategy_type x deviation x rebalance_hours x start_hour)
+    за один батчевый проход по общим входным массивам.
+
+    Возвращает широкую таблицу strategy_ret (колонки - имена конфигураций),
+    совпадающую с run_strategy(...)['strategy_ret'] для каждой конфигурации.
+    Развернутые конфигурации лежат в result.attrs['configs'].
+    """
+    configs = expand_grid(grid)
+    with profiling.phase('data_copy'):
+        inputs = _prepare_inputs(data, lst_token, lst_token_ret, hedge_token, hedge_token_ret,
+                                 cross_token, funding_type, cross_ex)
+    index = inputs['data'].index
+
+    codes = np.array([strategy_code(c['strategy_type']) for c in configs], dtype=np.int64)
+    deviations = np.array([c['deviation'] for c in configs], dtype=np.float64)
+    time_reb = np.empty((len(index), len(configs)), dtype=bool)
+    for j, c in enumerate(configs):
+        time_reb[:, j] = _time_rebalance_mask(index, c['rebalance_hours'], c['start_hour'])
+
+    with profiling.phase('main_loop'):
+        strategy_ret = _simulate_batch(inputs, codes, deviations, time_reb, init_capital,
+                                       fut_fees, spot_fees, lst_collateral, cross_ex)
+
+    result = pd.DataFrame(strategy_ret, index=index, columns=[c['name'] for c in configs])
+    result.attrs['configs'] = configs
+    return result
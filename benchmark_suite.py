@@ -0,0 +1,268 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# Бенчмарки горячих путей: run_strategy по типам стратегий, calculate_metrics,
+# хвостовые риски и загрузка данных дашборда. Данные синтетические и
+# детерминированные (фиксированный seed), сеть не нужна.
+#
+#   python benchmark_suite.py --sizes 1m,1y,5y --output bench.json
+#   python benchmark_suite.py --compare bench_old.json
+#
+# Для каждого случая: время (лучшее из repeat запусков после прогрева),
+# пиковая память по tracemalloc (отдельный запуск; видит python и numpy,
+# но не внутренние буферы pyarrow) и баров в секунду.
+#
+#   python benchmark_suite.py --check-imports
+# - проверка времени импорта модулей для воркеров свипа: код выхода 1,
+# если модуль превысил бюджет или подтянул matplotlib / scipy.stats / plotly.
+
+SIZES = {'1m': 24 * 30, '1y': 24 * 365, '5y': 24 * 365 * 5}
+
+STRATEGY_TYPES = ['cap_dev', 'cap_dev_only_buy', 'pos_dev', 'pos_dev_only_buy', 'time']
+
+# Колонки как в sl_data.xlsx
+STRATEGY_PARAMS = {
+    'lst_token': 'meth_close',
+    'lst_token_ret': 'meth_ret',
+    'hedge_token': 'eth_fut_close',
+    'hedge_token_ret': 'eth_fut_ret',
+    'cross_token': 'eth_close',
+    'funding_type': 'eth_fund_h',
+    'init_capital': 1000,
+    'fut_fees': 0.0005,
+    'spot_fees': 0.001,
+}
+
+# Сетка для матрицы доходностей в бенчмарках метрик (24 стратегии, порядок sl_returns)
+METRICS_GRID = {
+    'strategy_type': ['cap_dev', 'cap_dev_only_buy', 'pos_dev', 'pos_dev_only_buy'],
+    'deviation': [0.005, 0.01],
+    'rebalance_hours': [1, 12, 24],
+}
+
+DEFAULT_OUTPUT = 'benchmark_results.json'
+
+# Бюджет времени импорта, секунды сверх уже загруженных numpy/pandas.
+# backtester и sweep тянут numba (njit-ядра), остальные - только numpy/pandas
+IMPORT_BUDGETS = {
+    'metrics_core': 0.1,
+    'tail_risk': 0.1,
+    'strategy_analytics_v2': 0.1,
+    'analytics': 0.1,
+    'backtester': 0.5,
+    'sweep': 0.5,
+}
+
+# Тяжелые зависимости графиков и статистики - только при первом использовании
+HEAVY_MODULES = ('matplotlib', 'scipy.stats', 'plotly')
+
+_IMPORT_PROBE = '''
+import json, sys, time
+import numpy, pandas
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - start,
+                  'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def synthetic_data(n_bars, seed=0):
+    """
+    Часовые данные в формате sl_data.xlsx: цены METH/ETH (METH в ETH),
+    ETH спот и фьючерс, часовой фандинг раз в 8 часов и доходности.
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2020-01-01', periods=n_bars, freq='h', name='time')
+    eth = 2000 * np.exp(np.cumsum(rng.normal(0, 0.006, n_bars)))
+    basis = 1 + rng.normal(0, 0.0005, n_bars)
+    meth = 1.01 * np.exp(np.cumsum(rng.normal(2e-6, 0.0004, n_bars)))
+    funding = np.where(np.arange(n_bars) % 8 == 0, rng.normal(1e-4, 5e-5, n_bars), 0.0)
+    data = pd.DataFrame({
+        'meth_close': meth,
+        'eth_close': eth,
+        'eth_fut_close': eth * basis,
+        'eth_fund_h': funding,
+    }, index=index)
+    data['meth_ret'] = data['meth_close'].pct_change().fillna(0)
+    data['eth_fut_ret'] = data['eth_fut_close'].pct_change().fillna(0)
+    return data
+
+
+def measure(func, repeat=3):
+    """(лучшее время, пиковая память в МБ) для func() после прогрева."""
+    func()
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak / 1024 ** 2
+
+
+def _record(results, name, size, bars, wall, peak):
+    results.append({
+        'name': name,
+        'size': size,
+        'bars': int(bars),
+        'wall_s': wall,
+        'peak_mb': peak,
+        'bars_per_s': bars / wall if wall > 0 else None,
+    })
+    print(f'{name:<40} {size:>3} {wall * 1000:10.2f} ms {peak:9.1f} MB {bars / wall:14,.0f} bars/s', flush=True)
+
+
+def bench_run_strategy(results, data, size, repeat):
+    from backtester import run_strategy
+
+    for strategy_type in STRATEGY_TYPES:
+        params = dict(STRATEGY_PARAMS, strategy_type=strategy_type, deviation=0.01,
+                      rebalance_hours=24 if strategy_type == 'time' else None)
+        wall, peak = measure(lambda: run_strategy(data, **params), repeat)
+        _record(results, f'run_strategy[{strategy_type}]', size, len(data), wall, peak)
+
+
+def bench_analytics(results, data, size, repeat):
+    from backtester import run_grid
+    from strategy_analytics_v2 import calculate_metrics
+    from tail_risk import tail_risk_table
+
+    returns = run_grid(data, METRICS_GRID, **STRATEGY_PARAMS)
+    bars = returns.size
+    wall, peak = measure(lambda: calculate_metrics(returns), repeat)
+    _record(results, 'calculate_metrics', size, bars, wall, peak)
+    wall, peak = measure(lambda: tail_risk_table(returns), repeat)
+    _record(results, 'tail_risk_table', size, bars, wall, peak)
+    return returns
+
+
+def bench_dashboard_load(results, returns, size, repeat):
+    import results_store
+    from dashboard_utils import CumulativeIndex
+    from strategy_analytics_v2 import calculate_metrics
+    from tail_risk import tail_risk_table
+
+    with tempfile.TemporaryDirectory() as root:
+        results_store.write_returns(returns, root)
+        results_store.write_metrics(calculate_metrics(returns), root)
+        results_store.write_tail_risk(tail_risk_table(returns), root)
+
+        def load():
+            # То, что дашборд читает при холодном старте
+            loaded = results_store.load_returns(root=root)
+            results_store.load_metrics(root=root)
+            results_store.load_tail_risk(root=root)
+            CumulativeIndex(loaded).window(loaded.index[0], loaded.index[-1])
+
+        wall, peak = measure(load, repeat)
+    _record(results, 'dashboard_load', size, returns.size, wall, peak)
+
+
+def check_import_times(budgets=None, repeat=3):
+    """
+    Время импорта каждого модуля в чистом процессе (лучшее из repeat).
+    Возвращает (записи, нарушения): превышение бюджета или загрузка HEAVY_MODULES.
+    """
+    budgets = IMPORT_BUDGETS if budgets is None else budgets
+    root = os.path.dirname(os.path.abspath(__file__))
+    records, failures = [], []
+    for module, budget in budgets.items():
+        code = _IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES)
+        runs = [json.loads(subprocess.check_output([sys.executable, '-c', code], cwd=root, text=True))
+                for _ in range(repeat)]
+        seconds = min(run['seconds'] for run in runs)
+        heavy = runs[0]['heavy']
+        records.append({'module': module, 'seconds': seconds, 'budget_s': budget, 'heavy': heavy})
+        print(f'import {module:<32} {seconds * 1000:8.1f} ms (budget {budget * 1000:.0f} ms)'
+              + (f'  loads {", ".join(heavy)}' if heavy else ''), flush=True)
+        if seconds > budget:
+            failures.append(f'{module}: {seconds:.3f}s > {budget:.3f}s')
+        if heavy:
+            failures.append(f'{module}: imports {", ".join(heavy)}')
+    return records, failures
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes=('1m', '1y', '5y'), repeat=3, seed=0):
+    from backtester import ENGINE_BACKEND
+
+    results = []
+    for size in sizes:
+        data = synthetic_data(SIZES[size], seed)
+        bench_run_strategy(results, data, size, repeat)
+        returns = bench_analytics(results, data, size, repeat)
+        bench_dashboard_load(results, returns, size, repeat)
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': pd.Timestamp.now(tz='UTC').isoformat(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'engine_backend': ENGINE_BACKEND,
+            'seed': seed,
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline):
+    """Печатает отношение времени к прошлому прогону (>1 - стало медленнее)."""
+    old = {(r['name'], r['size']): r for r in baseline['results']}
+    print(f"\nvs {baseline['meta'].get('commit')}:")
+    for r in current['results']:
+        prev = old.get((r['name'], r['size']))
+        if prev is not None:
+            print(f"{r['name']:<40} {r['size']:>3} time x{r['wall_s'] / prev['wall_s']:.2f}"
+                  f"  memory x{r['peak_mb'] / max(prev['peak_mb'], 1e-9):.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бенчмарки бектестера и аналитики')
+    parser.add_argument('--sizes', default='1m,1y,5y', help='через запятую: ' + ','.join(SIZES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--check-imports', action='store_true',
+                        help='только проверить время импорта (код выхода 1 при регрессии)')
+    args = parser.parse_args()
+
+    if args.check_imports:
+        _, failures = check_import_times(repeat=args.repeat)
+        for failure in failures:
+            print(f'FAIL {failure}')
+        sys.exit(1 if failures else 0)
+
+    report = run_suite([s for s in args.sizes.split(',') if s], args.repeat, args.seed)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f'saved {args.output}')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
@@ -1,8 +1,91 @@
+import os
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 from datetime import time
 
+import results_store
+from metrics_core import BENCHMARKS_PATH, load_benchmarks
+from dashboard_utils import CVAR_LEVELS, DEFAULT_MAX_POINTS, CumulativeIndex, WindowMetricsCache, downsample_long
+
+RESULTS_ROOT = results_store.DEFAULT_ROOT
+TIME_COL = 'time'
+
+
+def source_path(table):
+    """
+    Файл-источник таблицы: хранилище Parquet или Excel - тот, что изменен
+    позже (свежая выгрузка sl_*.xlsx не перекрывается старым хранилищем).
+    """
+    store = {
+        'metrics': os.path.join(RESULTS_ROOT, 'metrics.parquet'),
+        'returns': os.path.join(RESULTS_ROOT, 'returns', 'strategies.json'),
+        'tail_risk': os.path.join(RESULTS_ROOT, 'tail_risk.parquet'),
+    }[table]
+    excel = results_store.EXCEL_FILES[table]
+    if not os.path.exists(store):
+        return excel
+    if not os.path.exists(excel):
+        return store
+    return store if source_mtime(store) >= source_mtime(excel) else excel
+
+
+def source_mtime(path):
+    # Только stat файла: содержимое читается лишь при изменении mtime
+    return os.path.getmtime(path)
+
+
+# Кэш общий для всех перезапусков и сессий; ключ - путь и mtime файла,
+# поэтому изменение файла на диске автоматически инвалидирует запись
+@st.cache_data(show_spinner=False)
+def load_metrics_table(path, mtime):
+    if path.endswith('.parquet'):
+        stats = results_store.load_metrics(root=RESULTS_ROOT)
+    else:
+        stats = pd.read_excel(path)
+    return stats.drop(columns=[c for c in ['Unnamed: 0', 'Monthly Turnover'] if c in stats.columns])
+
+
+@st.cache_data(show_spinner=False)
+def load_returns_table(path, mtime):
+    """Доходности с отсортированным DatetimeIndex, только числовые колонки."""
+    if path.endswith('.json'):
+        return results_store.load_returns(root=RESULTS_ROOT)
+    df = pd.read_excel(path)
+    if TIME_COL not in df.columns:
+        raise KeyError(f"В Excel-файле должен быть столбец '{TIME_COL}'")
+    df[TIME_COL] = pd.to_datetime(df[TIME_COL], errors='coerce')
+    df = df.dropna(subset=[TIME_COL]).sort_values(TIME_COL).set_index(TIME_COL)
+    return df.select_dtypes(include='number')
+
+
+# Кумулятивный индекс только читается, поэтому кэшируем сам объект без копирования
+@st.cache_resource(show_spinner=False)
+def load_cumulative_index(path, mtime):
+    return CumulativeIndex(load_returns_table(path, mtime))
+
+
+# Метрики по окнам мемоизируются в одном объекте на все сессии;
+# изменение реестра бенчмарков (mtime файла) создает новый кэш
+@st.cache_resource(show_spinner=False)
+def get_window_metrics_cache(benchmarks_path, benchmarks_mtime):
+    return WindowMetricsCache(rates=load_benchmarks(benchmarks_path))
+
+
+@st.cache_data(show_spinner=False)
+def load_tail_risk_table(path, mtime):
+    if path.endswith('.parquet'):
+        cvar = results_store.load_tail_risk(root=RESULTS_ROOT)
+    else:
+        cvar = pd.read_excel(path)
+    return cvar.drop(columns=[c for c in ['Unnamed: 0'] if c in cvar.columns])
+
+
+def load_table(loader, table):
+    path = source_path(table)
+    return loader(path, source_mtime(path))
+
+
 # Настройка страницы
 st.set_page_config(page_title="METH/ETH backtest Dashboard", layout="wide")
 
@@ -32,28 +115,15 @@ try:
         
     """)
     
-    stats = pd.read_excel('sl_metrics.xlsx')
-    if 'Unnamed: 0' in stats.columns:
-        stats.drop(columns=['Unnamed: 0'], inplace=True)
-    if 'Monthly Turnover' in stats.columns:
-        stats.drop(columns=['Monthly Turnover'], inplace=True)
+    stats = load_table(load_metrics_table, 'metrics')
     st.dataframe(stats.style.format(precision=4))
 
-    # Загружаем доходности
-    df = pd.read_excel("sl_returns.xlsx")
-
-    # Проверяем наличие столбца времени
-    time_col = 'time'
-    if time_col not in df.columns:
-        st.error(f"В Excel-файле должен быть столбец '{time_col}'")
-        st.stop()
-
-    # Преобразуем в datetime
-    df[time_col] = pd.to_datetime(df[time_col], errors='coerce')
-    df = df.dropna(subset=[time_col]).sort_values(time_col).reset_index(drop=True)
+    # Загружаем доходности (уже с временным индексом)
+    time_col = TIME_COL
+    df = load_table(load_returns_table, 'returns')
 
     # --- Выбор нескольких столбцов ---
-    numeric_columns = df.select_dtypes(include='number').columns.tolist()
+    numeric_columns = df.columns.tolist()
     if not numeric_columns:
         st.error("Нет числовых столбцов для построения графика.")
         st.stop()
@@ -71,8 +141,8 @@ try:
     # --- Выбор периода (только полные часы) ---
     st.write("### 🔍 Выберите временной диапазон (по полным часам)")
 
-    min_dt = df[time_col].min()
-    max_dt = df[time_col].max()
+    min_dt = df.index.min()
+    max_dt = df.index.max()
 
     # Округляем время до ближайшего часа (вниз)
     min_time_rounded = time(min_dt.hour, 0, 0)
@@ -96,22 +166,27 @@ try:
         st.warning("Время начала не может быть позже или равно времени окончания.")
         st.stop()
 
-    # Фильтрация
-    mask = (df[time_col] >= start) & (df[time_col] <= end)
-    filtered_df = df[[time_col] + selected_columns][mask].copy()
+    max_points = st.number_input(
+        "Максимум точек на стратегию на графике",
+        min_value=200,
+        max_value=100000,
+        value=DEFAULT_MAX_POINTS,
+        step=500
+    )
+
+    # Окно из предрасчитанного кумулятивного индекса: поиск границ + деление на базу
+    cumulative_index = load_table(load_cumulative_index, 'returns')
+    cumulative_df = cumulative_index.window(start, end, selected_columns)
 
-    if filtered_df.empty:
+    if cumulative_df.empty:
         st.info("Нет данных в выбранном диапазоне времени.")
     else:
-        # --- РАСЧЁТ КУМУЛЯТИВНОЙ ДОХОДНОСТИ ---
-        cumulative_df = filtered_df[[time_col]].copy()
-        for col in selected_columns:
-            cumulative_df[col] = (1 + filtered_df[col]).cumprod()
-
-        # Подготовка для Plotly
-        plot_df = cumulative_df.melt(
-            id_vars=[time_col],
-            value_vars=selected_columns,
+        # Подготовка для Plotly: прореживание min/max до max_points на серию
+        # (на узком диапазоне точек меньше лимита - рисуется полное разрешение)
+        plot_df = downsample_long(
+            cumulative_df,
+            max_points=max_points,
+            time_col=time_col,
             var_name='Strategy',
             value_name='Cumulative returns'
         )
@@ -163,13 +238,26 @@ try:
 
         st.plotly_chart(fig, use_container_width=True)
 
+        # --- Метрики за выбранный период ---
+        st.write("### Метрики за выбранный период")
+        returns_path = source_path('returns')
+        window_table = get_window_metrics_cache(
+            BENCHMARKS_PATH, source_mtime(BENCHMARKS_PATH) if os.path.exists(BENCHMARKS_PATH) else None
+        ).table(
+            df, start, end, selected_columns, version=(returns_path, source_mtime(returns_path))
+        )
+        st.dataframe(
+            window_table.drop(columns=list(CVAR_LEVELS)).style.format(precision=4)
+        )
+
         # Показываем статистику
         st.write("### Анализ хвостовых рисков")
-        cvar = pd.read_excel('sl_cvar.xlsx')
-        if 'Unnamed: 0' in cvar.columns:
-            cvar.drop(columns=['Unnamed: 0'], inplace=True)
+        cvar = load_table(load_tail_risk_table, 'tail_risk')
         st.dataframe(cvar.style.format(precision=4))
 
+        st.write("Исторический CVaR за выбранный период (часовые доходности)")
+        st.dataframe(window_table[['Strategy'] + list(CVAR_LEVELS)].style.format(precision=4))
+
 except FileNotFoundError as e:
     st.error(f"Файл не найден: убедитесь, что sl_returns.xlsx и sl_metrics.xlsx находятся в папке приложения.")
 except Exception as e:
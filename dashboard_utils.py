@@ -0,0 +1,141 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from metrics_core import metrics_table
+from tail_risk import historical
+
+# Вспомогательные функции дашборда без зависимости от streamlit
+
+# Сколько точек на серию отправлять в браузер по умолчанию
+DEFAULT_MAX_POINTS = 2000
+
+# Доходности в sl_returns часовые, метрики аннуализируются по часам
+HOURS_PER_YEAR = 24 * 365
+
+# Уровни CVaR для таблицы хвостовых рисков по окну
+CVAR_LEVELS = {'CVaR (95%)': 0.95, 'CVaR (97,5%)': 0.975, 'CVaR (99%)': 0.99}
+
+
+def minmax_indices(values, max_points=DEFAULT_MAX_POINTS):
+    """
+    Индексы точек для отрисовки после min/max-бакетирования.
+
+    Ряд делится на ~max_points/2 равных корзин, из каждой берутся минимум и
+    максимум (плюс первая и последняя точки ряда). Пики и просадки при этом
+    сохраняются, поэтому максимальная просадка на графике не искажается.
+    Если точек и так не больше max_points - возвращаются все.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+
+    n_buckets = max(1, (max_points - 2) // 2)
+    size = int(np.ceil(n / n_buckets))
+    # NaN не должны выигрывать argmin/argmax - заполняем соседними значениями
+    filled = pd.Series(values).ffill().bfill().to_numpy()
+    padded = np.concatenate([filled, np.repeat(filled[-1], n_buckets * size - n)])
+    blocks = padded.reshape(n_buckets, size)
+    offsets = np.arange(n_buckets) * size
+    lows = np.minimum(offsets + blocks.argmin(axis=1), n - 1)
+    highs = np.minimum(offsets + blocks.argmax(axis=1), n - 1)
+    return np.unique(np.concatenate([[0, n - 1], lows, highs]))
+
+
+def downsample_long(frame, max_points=DEFAULT_MAX_POINTS, time_col='time',
+                    var_name='Strategy', value_name='Cumulative returns'):
+    """
+    Прореживает каждую колонку frame (индекс - время) независимо и
+    возвращает длинную таблицу для px.line: time_col, var_name, value_name.
+    """
+    times = frame.index
+    parts = []
+    for col in frame.columns:
+        values = frame[col].to_numpy()
+        idx = minmax_indices(values, max_points)
+        parts.append(pd.DataFrame({
+            time_col: times[idx],
+            var_name: col,
+            value_name: values[idx],
+        }))
+    if not parts:
+        return pd.DataFrame(columns=[time_col, var_name, value_name])
+    return pd.concat(parts, ignore_index=True)
+
+
+class CumulativeIndex:
+    """
+    Предрасчитанная кумулятивная доходность (1 + r).cumprod() по всей истории.
+
+    Окно [start, end] получается срезом по позициям из searchsorted и делением
+    на значение на баре перед start - без повторного cumprod на каждое
+    изменение диапазона. Пропуски в доходностях считаются нулевой доходностью.
+    """
+
+    def __init__(self, returns):
+        self.index = pd.DatetimeIndex(returns.index)
+        self.columns = list(returns.columns)
+        self.values = np.cumprod(1 + returns.fillna(0).to_numpy(dtype=np.float64), axis=0)
+        self._positions = {col: i for i, col in enumerate(self.columns)}
+
+    def window(self, start, end, columns=None):
+        """Кумулятивная доходность за [start, end], как (1 + r[start:end]).cumprod()."""
+        columns = self.columns if columns is None else list(columns)
+        cols = [self._positions[col] for col in columns]
+        i0 = self.index.searchsorted(start, side='left')
+        i1 = self.index.searchsorted(end, side='right')
+        values = self.values[i0:i1, cols]
+        if i0 > 0:
+            values = values / self.values[i0 - 1, cols]
+        return pd.DataFrame(values, index=self.index[i0:i1], columns=columns)
+
+
+def window_metrics(returns, periods=HOURS_PER_YEAR, rates=None):
+    """
+    Метрики calculate_metrics и исторический CVaR (ES tail_risk, то же
+    определение, что в таблице sl_cvar) по всем колонкам окна.
+    """
+    table = metrics_table(returns, rates, periods)
+    _, es = historical(returns, tuple(CVAR_LEVELS.values()))
+    for name, level in CVAR_LEVELS.items():
+        table[name] = es.loc[level].to_numpy()
+    return table
+
+
+class WindowMetricsCache:
+    """
+    Мемоизация метрик по ключу (версия данных, стратегия, окно).
+
+    Для стратегий, которых нет в кэше, метрики считаются одним векторным
+    вызовом window_metrics; хранится не больше max_entries строк (LRU).
+    Объект общий для сессий streamlit, поэтому доступ под блокировкой.
+    rates - реестр бенчмарков для Sharpe/Sortino (None - BENCHMARK_RATES).
+    """
+
+    def __init__(self, max_entries=4096, periods=HOURS_PER_YEAR, rates=None):
+        self.max_entries = max_entries
+        self.periods = periods
+        self.rates = rates
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def table(self, returns, start, end, strategies, version=None):
+        keys = [(version, strategy, start, end) for strategy in strategies]
+        with self._lock:
+            missing = [key[1] for key in keys if key not in self._rows]
+        if missing:
+            computed = window_metrics(returns.loc[start:end, missing], self.periods, self.rates)
+            with self._lock:
+                for row in computed.to_dict('records'):
+                    self._rows[(version, row['Strategy'], start, end)] = row
+        with self._lock:
+            rows = []
+            for key in keys:
+                self._rows.move_to_end(key)
+                rows.append(self._rows[key])
+            while len(self._rows) > self.max_entries:
+                self._rows.popitem(last=False)
+        return pd.DataFrame(rows)
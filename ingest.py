@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# Загрузка рыночных данных (OHLC, фандинг) из CSV / Parquet / Excel в один
+# кадр для run_strategy на часовой сетке.
+#
+# Источник описывается словарем:
+#   {'path': 'eth_fut.csv',             - файл (.csv, .parquet, .xlsx/.xls)
+#    'time_column': 'time',             - колонка времени (по умолчанию 'time')
+#    'columns': {'close': 'eth_fut_close'},  - какие колонки взять и как назвать
+#    'sheet_name': 0}                   - лист Excel (необязательно)
+#
+# Готовый кадр кэшируется на диск одной матрицей .npy в порядке колонок
+# (Fortran), открывается через np.load(mmap_mode='r') без парсинга.
+
+DEFAULT_CACHE_DIR = '.data_cache'
+DEFAULT_FREQ = 'h'
+DTYPES = {'float32': np.float32, 'float64': np.float64}
+
+# Версия формата кэша: повышать при изменении логики сборки кадра
+CACHE_VERSION = 1
+
+
+def _to_numeric(series):
+    """Числа из выгрузок вида '74,158.934', '0.172%', '-' (пусто)."""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(np.float64)
+    text = series.astype(str).str.strip()
+    percent = text.str.endswith('%')
+    text = text.str.replace(',', '', regex=False).str.rstrip('%').str.strip()
+    values = pd.to_numeric(text.where(text != '-'), errors='coerce')
+    return values.where(~percent, values / 100).astype(np.float64)
+
+
+def read_source(source):
+    """Читает один источник в кадр с отсортированным DatetimeIndex (UTC, без таймзоны)."""
+    path = source['path']
+    time_column = source.get('time_column', 'time')
+    columns = source.get('columns')
+    usecols = None if columns is None else [time_column] + list(columns)
+
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path, columns=usecols)
+    elif path.endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(path, sheet_name=source.get('sheet_name', 0), usecols=usecols)
+    else:
+        df = pd.read_csv(path, usecols=usecols)
+
+    index = pd.to_datetime(df.pop(time_column), errors='coerce')
+    if index.dt.tz is not None:
+        index = index.dt.tz_convert('UTC').dt.tz_localize(None)
+    df = df.apply(_to_numeric)
+    df.index = pd.DatetimeIndex(index, name='time')
+    df = df[df.index.notna()]
+    if columns is not None:
+        df = df.rename(columns=columns)
+    return df.sort_index()
+
+
+def build_frame(sources, returns=None, freq=DEFAULT_FREQ, dtype='float64', ffill=None, zero_fill=None):
+    """
+    Собирает источники в один кадр на сетке freq.
+
+    Внутри часа берется последнее наблюдение источника; все источники
+    объединяются одним сортированным слиянием (concat по оси колонок)
+    и раскладываются на полную сетку от первого до последнего бара.
+
+    returns   - {'meth_ret': 'meth_close', ...}: доходности считаются один раз
+    dtype     - 'float32' или 'float64' для всех колонок
+    ffill     - колонки, пропуски в которых заполняются последним значением (цены)
+    zero_fill - колонки, пропуски в которых - ноль (фандинг вне часов выплат)
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unknown dtype '{dtype}', expected one of {list(DTYPES)}")
+    frames = []
+    for source in sources:
+        df = read_source(source) if isinstance(source, dict) else source
+        frames.append(df.groupby(df.index.floor(freq)).last())
+    data = pd.concat(frames, axis=1, join='outer', sort=True)
+    duplicated = data.columns[data.columns.duplicated()].tolist()
+    if duplicated:
+        raise ValueError(f'Columns present in several sources: {duplicated}')
+
+    grid = pd.date_range(data.index.min(), data.index.max(), freq=freq, name='time') if len(data) else data.index
+    data = data.reindex(grid)
+    if ffill:
+        data[list(ffill)] = data[list(ffill)].ffill()
+    if zero_fill:
+        data[list(zero_fill)] = data[list(zero_fill)].fillna(0.0)
+    for ret_col, price_col in (returns or {}).items():
+        data[ret_col] = data[price_col].pct_change(fill_method=None)
+    return data.astype(DTYPES[dtype])
+
+
+def _frame_digest(df):
+    # Кадр в памяти: хэш индекса, значений и имен колонок
+    digest = hashlib.sha1()
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    digest.update(json.dumps([str(c) for c in df.columns]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _cache_key(sources, params):
+    # Ключ: файлы (путь, размер, mtime), содержимое кадров в памяти и параметры сборки
+    digest = hashlib.sha1()
+    files = []
+    for source in sources:
+        if not isinstance(source, dict):
+            files.append({'frame': _frame_digest(source)})
+            continue
+        stat = os.stat(source['path'])
+        files.append(dict(source, path=os.path.abspath(source['path']), size=stat.st_size,
+                          mtime_ns=stat.st_mtime_ns))
+    payload = {'version': CACHE_VERSION, 'sources': files, 'params': params}
+    digest.update(json.dumps(payload, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def save_frame(data, path):
+    """Кадр в папку path: values.npy (Fortran-порядок), index.npy, meta.json."""
+    tmp = f'{path}.tmp-{uuid.uuid4().hex}'
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, 'values.npy'), np.asfortranarray(data.to_numpy()))
+    np.save(os.path.join(tmp, 'index.npy'), data.index.asi8)
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'columns': list(data.columns), 'index_name': data.index.name}, f, ensure_ascii=False)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        # Тот же кадр уже сохранен другим процессом
+        for name in os.listdir(tmp):
+            os.remove(os.path.join(tmp, name))
+        os.rmdir(tmp)
+
+
+def open_frame(path):
+    """Кадр поверх memory-mapped values.npy (только чтение, без копирования)."""
+    with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+    index = pd.DatetimeIndex(np.load(os.path.join(path, 'index.npy')), name=meta['index_name'])
+    return pd.DataFrame(values, index=index, columns=meta['columns'], copy=False)
+
+
+def load_market_data(sources, returns=None, freq=DEFAULT_FREQ, dtype='float64', ffill=None,
+                     zero_fill=None, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    build_frame с кэшем на диске: повторный вызов с теми же файлами и
+    параметрами открывает сохраненный кадр без чтения источников.
+    Источники-DataFrame входят в ключ хэшем индекса и значений.
+    cache_dir=None - без кэша.
+    """
+    params = dict(returns=returns, freq=freq, dtype=dtype, ffill=ffill, zero_fill=zero_fill)
+    if cache_dir is None:
+        return build_frame(sources, **params)
+    path = os.path.join(cache_dir, _cache_key(sources, params))
+    if not os.path.exists(path):
+        save_frame(build_frame(sources, **params), path)
+    return open_frame(path)
@@ -0,0 +1,311 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import profiling
+
+# Векторные метрики по матрице доходностей (бары x стратегии).
+# Зависит только от numpy/pandas: без matplotlib, scipy и var.
+# Пропуски (NaN) в колонке игнорируются, как при returns.dropna().
+
+# Безрисковые ставки для Sharpe/Sortino (годовые), если нет файла реестра
+BENCHMARK_RATES = {
+    'US Treasury': 0.047,
+    'AAVE': 0.0677,
+    'Coinbase': 0.06,
+    'Lido': 0.028,
+    'Jupiter': 0.0211,
+    'Kamino': 0.0721,
+}
+
+BENCHMARKS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_rates.json')
+
+
+def _read_rate_series(path, column, time_column):
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+    elif path.endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(path)
+    else:
+        df = pd.read_csv(path)
+    series = pd.Series(df[column].to_numpy(dtype=np.float64), index=pd.to_datetime(df[time_column]))
+    return series.sort_index()
+
+
+def load_benchmarks(path=BENCHMARKS_PATH):
+    """
+    Реестр бенчмарков из JSON: {"Имя": {"rate": 0.0677}, ...}.
+
+    Для переменной ставки указывается файл с рядом годовых ставок
+    (CSV / Parquet / Excel):
+        {"AAVE": {"rate": 0.0677, "series": "aave_supply_apy.csv",
+                  "column": "apy", "time_column": "time"}}
+    rate тогда используется до начала ряда. Относительные пути считаются
+    от папки файла реестра. Без файла возвращается BENCHMARK_RATES.
+    """
+    if not os.path.exists(path):
+        return dict(BENCHMARK_RATES)
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    benchmarks = {}
+    for name, spec in config.items():
+        if not isinstance(spec, dict):
+            benchmarks[name] = float(spec)
+        elif 'series' in spec:
+            series = _read_rate_series(os.path.join(base, spec['series']),
+                                       spec.get('column', 'rate'), spec.get('time_column', 'time'))
+            series.attrs['fallback'] = spec.get('rate')
+            benchmarks[name] = series
+        else:
+            benchmarks[name] = float(spec['rate'])
+    return benchmarks
+
+
+def resolve_benchmarks(benchmarks, risk_free_rate=None):
+    """
+    benchmarks=None - реестр load_benchmarks(). risk_free_rate, если
+    передан, заменяет ставку 'US Treasury'; иначе остается ставка реестра.
+    """
+    benchmarks = load_benchmarks() if benchmarks is None else benchmarks
+    if risk_free_rate is not None:
+        benchmarks = dict(benchmarks, **{'US Treasury': risk_free_rate})
+    return benchmarks
+
+
+def benchmark_rates(benchmarks, index):
+    """
+    Приводит реестр к массиву ставок для векторного расчета:
+    (b,) если все ставки постоянные, иначе (n, b) - ставка на каждый бар index.
+    """
+    if all(np.isscalar(rate) for rate in benchmarks.values()):
+        return np.array([benchmarks[name] for name in benchmarks], dtype=np.float64)
+    index = pd.DatetimeIndex(index)
+    columns = []
+    for rate in benchmarks.values():
+        if np.isscalar(rate):
+            columns.append(np.full(len(index), rate, dtype=np.float64))
+            continue
+        aligned = rate.reindex(index, method='ffill')
+        fallback = rate.attrs.get('fallback')
+        aligned = aligned.fillna(rate.iloc[0] if fallback is None else fallback)
+        columns.append(aligned.to_numpy(dtype=np.float64))
+    return np.column_stack(columns) if columns else np.empty((len(index), 0))
+
+
+# Баров в году, если частоту нельзя определить по индексу
+DEFAULT_PERIODS = 365
+
+
+def infer_periods(index, default=DEFAULT_PERIODS):
+    """
+    Число баров в году по шагу DatetimeIndex (медиана интервалов):
+    часовые бары - 8760, дневные - 365. Для индекса без дат - default.
+    """
+    if not isinstance(index, pd.DatetimeIndex) or len(index) < 2:
+        return default
+    steps = np.diff(index.asi8)
+    steps = steps[steps > 0]
+    if not len(steps):
+        return default
+    return pd.Timedelta(days=365) / pd.Timedelta(int(np.median(steps)), unit='ns')
+
+
+def resolve_periods(periods, index):
+    """periods=None - определить по индексу, иначе как передано."""
+    return infer_periods(index) if periods is None else periods
+
+
+def resample_returns(returns, rule):
+    """
+    Компаундирование доходностей в бары rule ('D', 'W', ...) за один проход
+    по всем колонкам: сумма log(1 + r) в корзине, затем expm1.
+    Корзины без данных - NaN.
+    """
+    logs = np.log1p(returns.sort_index())
+    return np.expm1(logs.resample(rule).sum(min_count=1))
+
+
+def _matrix(returns):
+    values = returns.to_numpy(dtype=np.float64) if hasattr(returns, 'to_numpy') else np.asarray(returns, dtype=np.float64)
+    return values.reshape(len(values), -1)
+
+
+def moments(values):
+    """Число наблюдений, среднее и std (ddof=1) по колонкам без NaN."""
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=0)
+    filled = np.where(valid, values, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = filled.sum(axis=0) / count
+        centered = np.where(valid, values - mean, 0.0)
+        std = np.sqrt((centered ** 2).sum(axis=0) / (count - 1))
+    return count, mean, std
+
+
+def sharpe_ratios(values, rates, periods=365, stats=None):
+    """
+    Sharpe для каждой пары (стратегия, бенчмарк): матрица (k, b).
+    rates - (b,) постоянные годовые ставки или (n, b) ставки по барам.
+    """
+    count, mean, std = stats if stats is not None else moments(values)
+    rates = np.asarray(rates, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if rates.ndim == 1:
+            # std(r - c) = std(r): один момент на колонку для всех ставок
+            return np.sqrt(periods) * (mean[:, None] - rates[None, :] / periods) / std[:, None]
+
+        valid = ~np.isnan(values)
+        excess_rate = rates / periods
+        mean_excess = mean[:, None] - (valid.T.astype(np.float64) @ excess_rate) / count[:, None]
+        std_excess = np.empty_like(mean_excess)
+        for j in range(rates.shape[1]):
+            centered = np.where(valid, values - excess_rate[:, j:j+1] - mean_excess[:, j], 0.0)
+            std_excess[:, j] = np.sqrt((centered ** 2).sum(axis=0) / (count - 1))
+        return np.sqrt(periods) * mean_excess / std_excess
+
+
+def _downside_sums(values, thresholds):
+    """
+    Сумма min(0, r - c)^2 по каждой колонке для набора порогов c: (k, b).
+    Колонки сортируются один раз, дальше для каждого порога - бинарный
+    поиск и префиксные суммы, поэтому новые бенчмарки почти ничего не стоят.
+    """
+    n, k = values.shape
+    ordered = np.sort(values, axis=0)  # NaN уходят в конец
+    filled = np.nan_to_num(ordered, nan=0.0)
+    prefix1 = np.vstack([np.zeros((1, k)), np.cumsum(filled, axis=0)])
+    prefix2 = np.vstack([np.zeros((1, k)), np.cumsum(filled ** 2, axis=0)])
+    count = (~np.isnan(values)).sum(axis=0)
+    sums = np.empty((k, len(thresholds)))
+    for i in range(k):
+        below = np.searchsorted(ordered[:count[i], i], thresholds, side='left')
+        sums[i] = prefix2[below, i] - 2 * thresholds * prefix1[below, i] + thresholds ** 2 * below
+    return np.maximum(sums, 0.0)
+
+
+def sortino_ratios(values, rates, periods=365, stats=None):
+    """
+    Sortino для каждой пары (стратегия, бенчмарк): матрица (k, b).
+    rates - (b,) постоянные годовые ставки или (n, b) ставки по барам.
+    """
+    count, mean, std = stats if stats is not None else moments(values)
+    rates = np.asarray(rates, dtype=np.float64)
+    valid = ~np.isnan(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if rates.ndim == 1:
+            excess_rate = rates / periods
+            downside = _downside_sums(values, excess_rate)
+            mean_excess = mean[:, None] - excess_rate[None, :]
+        else:
+            excess_rate = rates / periods
+            downside = np.empty((values.shape[1], rates.shape[1]))
+            for j in range(rates.shape[1]):
+                below = np.where(valid, np.minimum(0, values - excess_rate[:, j:j+1]), 0.0)
+                downside[:, j] = (below ** 2).sum(axis=0)
+            mean_excess = mean[:, None] - (valid.T.astype(np.float64) @ excess_rate) / count[:, None]
+        downside = np.sqrt(downside / count[:, None]) * np.sqrt(periods)
+        ratio = (mean_excess * periods) / downside
+    return np.where(downside != 0, ratio, np.nan)
+
+
+def annualized_volatility(values, periods=365, stats=None):
+    count, mean, std = stats if stats is not None else moments(values)
+    return std * np.sqrt(periods)
+
+
+def wealth(values):
+    """Кумулятивная доходность (1 + r).cumprod(), пропуски - нулевая доходность."""
+    return np.cumprod(1 + np.nan_to_num(values, nan=0.0), axis=0)
+
+
+def max_drawdown(values):
+    # Как max_drawdown(returns.dropna()): пик начинается с первого наблюдения
+    # колонки, а не с 1, поэтому ведущие NaN не превращают потерю первого бара в просадку
+    started = np.maximum.accumulate(~np.isnan(values), axis=0)
+    cumulative = np.where(started, wealth(values), np.nan)
+    peak = np.fmax.accumulate(cumulative, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        drawdown = (peak - cumulative) / peak
+    return np.fmax.reduce(drawdown, axis=0, initial=0.0) if len(values) else np.full(values.shape[1], np.nan)
+
+
+def total_return(values):
+    return np.prod(1 + np.nan_to_num(values, nan=0.0), axis=0) - 1
+
+
+def monthly_returns(values, index):
+    """
+    Доходность по календарным месяцам для всех колонок сразу:
+    сумма log(1 + r) внутри месяца, затем expm1.
+    Как resample('M') по колонке без NaN: месяц без данных между первым и
+    последним наблюдением колонки - 0%, месяцы вне этого диапазона - NaN.
+    index должен быть отсортированным DatetimeIndex.
+    """
+    index = pd.DatetimeIndex(index)
+    if len(index) == 0:
+        return pd.PeriodIndex([], freq='M'), np.empty((0, values.shape[1]))
+    month = index.year * 12 + (index.month - 1)
+    starts = np.flatnonzero(np.r_[True, month[1:] != month[:-1]])
+    valid = ~np.isnan(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        logs = np.where(valid, np.log1p(values), 0.0)
+    # Суммы по месяцам с данными раскладываются на полную сетку месяцев
+    n_months = month[-1] - month[0] + 1
+    bins = month[starts] - month[0]
+    sums = np.zeros((n_months, values.shape[1]))
+    counts = np.zeros((n_months, values.shape[1]), dtype=np.int64)
+    sums[bins] = np.add.reduceat(logs, starts, axis=0)
+    counts[bins] = np.add.reduceat(valid, starts, axis=0)
+    has = counts > 0
+    first = has.argmax(axis=0)
+    last = n_months - 1 - has[::-1].argmax(axis=0)
+    rows = np.arange(n_months)[:, None]
+    inside = (rows >= first) & (rows <= last) & has.any(axis=0)
+    monthly = np.where(inside, np.expm1(sums), np.nan)
+    return pd.period_range(index[0].to_period('M'), periods=n_months, freq='M'), monthly
+
+
+def metrics_table(returns, rates=None, periods=None, resample=None):
+    """
+    Таблица метрик в формате calculate_metrics для всех колонок returns сразу.
+    rates - реестр бенчмарков {имя: годовая ставка или ряд ставок}
+    (по умолчанию BENCHMARK_RATES). Sharpe/Sortino по всем бенчмаркам
+    считаются вместе как матрицы (стратегии x бенчмарки).
+    periods - баров в году (None - по шагу индекса, метрики на исходной сетке).
+    resample - правило pandas ('D'): доходности один раз компаундируются
+    в этот шаг, и все метрики считаются по результату.
+    """
+    rates = BENCHMARK_RATES if rates is None else rates
+    names = list(rates)
+    returns = resample_returns(returns, resample) if resample is not None else returns.sort_index()
+    periods = resolve_periods(periods, returns.index)
+    values = _matrix(returns)
+    rate_values = benchmark_rates(rates, returns.index)
+    with profiling.phase('moments'):
+        stats = moments(values)
+    with profiling.phase('sharpe_sortino'):
+        sharpe = sharpe_ratios(values, rate_values, periods, stats)
+        sortino = sortino_ratios(values, rate_values, periods, stats)
+    with profiling.phase('monthly'):
+        _, monthly = monthly_returns(values, returns.index)
+    with np.errstate(invalid='ignore'):
+        monthly_mean = np.nanmean(monthly, axis=0) if len(monthly) else np.full(values.shape[1], np.nan)
+        best = np.nanmax(monthly, axis=0) if len(monthly) else np.full(values.shape[1], np.nan)
+        worst = np.nanmin(monthly, axis=0) if len(monthly) else np.full(values.shape[1], np.nan)
+
+    table = {'Strategy': list(returns.columns)}
+    for j, name in enumerate(names):
+        table[f'Sharpe Ratio ({name})'] = sharpe[:, j]
+    for j, name in enumerate(names):
+        table[f'Sortino Ratio ({name})'] = sortino[:, j]
+    table['Volatility (ann)'] = annualized_volatility(values, periods, stats)
+    with profiling.phase('drawdown'):
+        table['Max Drawdown'] = max_drawdown(values)
+    table['Total Return'] = total_return(values)
+    table['Monthly Return'] = monthly_mean
+    table['Best Month'] = best
+    table['Worst Month'] = worst
+    return pd.DataFrame(table)
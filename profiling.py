@@ -0,0 +1,235 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Встроенное профилирование по фазам пайплайна: копирование данных,
+# инициализация колонок, основной цикл run_strategy, calculate_metrics,
+# CVaR, построение графиков, плюс счетчики (ребалансировки по strategy_type).
+#
+# Выключено по умолчанию; когда выключено, phase() возвращает общий
+# пустой контекст (одна проверка флага), а счетчики ничего не делают.
+#
+#   with profiling.profile(trace_memory=True) as report:
+#       run_strategy(...)
+#   report.save('profile.json')     # + profile.folded для flame graph
+#
+# Или для всего процесса: BACKTEST_PROFILE=profile.json python sweep_script.py
+# (BACKTEST_PROFILE_MEMORY=1 - еще и аллокации через tracemalloc).
+#
+# Пулы процессов (sweep, stress): инициализатор воркера получает
+# worker_options() и вызывает start_worker, задача возвращает take()
+# вместе с результатом, родитель добавляет его через merge().
+
+ENV_VAR = 'BACKTEST_PROFILE'
+ENV_MEMORY = 'BACKTEST_PROFILE_MEMORY'
+
+_NULL = nullcontext()
+
+
+class Report:
+    """
+    Накопленные замеры: по стеку фаз ('run_strategy;main_loop') число
+    вызовов, полное и собственное время, прирост и пик памяти (tracemalloc);
+    отдельно - счетчики событий.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.phases = {}
+        self.counters = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def phase(self, name):
+        stack = self._stack()
+        frame = {'name': name, 'child_time': 0.0, 'peak': 0}
+        if self.trace_memory:
+            current, traced_peak = tracemalloc.get_traced_memory()
+            # reset_peak стирает пик родителя до этой фазы - сохраняем его в кадр родителя
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], traced_peak)
+            tracemalloc.reset_peak()
+            frame['start_memory'] = current
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            path = ';'.join([f['name'] for f in stack] + [name])
+            allocated = peak = 0
+            if self.trace_memory:
+                current, traced_peak = tracemalloc.get_traced_memory()
+                peak = max(frame['peak'], traced_peak) - frame['start_memory']
+                allocated = current - frame['start_memory']
+            if stack:
+                stack[-1]['child_time'] += elapsed
+                if self.trace_memory:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], peak + frame['start_memory'])
+            with self._lock:
+                entry = self.phases.setdefault(path, {'calls': 0, 'total_s': 0.0, 'self_s': 0.0,
+                                                      'alloc_bytes': 0, 'peak_bytes': 0})
+                entry['calls'] += 1
+                entry['total_s'] += elapsed
+                entry['self_s'] += elapsed - frame['child_time']
+                entry['alloc_bytes'] += allocated
+                entry['peak_bytes'] = max(entry['peak_bytes'], peak)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, other):
+        """Добавляет замеры другого отчета (to_dict(), например из воркера пула)."""
+        with self._lock:
+            for path, other_entry in other['phases'].items():
+                entry = self.phases.setdefault(path, {'calls': 0, 'total_s': 0.0, 'self_s': 0.0,
+                                                      'alloc_bytes': 0, 'peak_bytes': 0})
+                for key in ('calls', 'total_s', 'self_s', 'alloc_bytes'):
+                    entry[key] += other_entry[key]
+                entry['peak_bytes'] = max(entry['peak_bytes'], other_entry['peak_bytes'])
+            for name, value in other['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        return {'trace_memory': self.trace_memory,
+                'phases': dict(sorted(self.phases.items())),
+                'counters': dict(sorted(self.counters.items()))}
+
+    def collapsed(self):
+        """Строки 'a;b;c <микросекунды собственного времени>' для flamegraph.pl / speedscope."""
+        return '\n'.join(f'{path} {int(round(entry["self_s"] * 1e6))}'
+                         for path, entry in sorted(self.phases.items())) + '\n'
+
+    def save(self, path):
+        """JSON в path и collapsed-стеки рядом (<path без .json>.folded)."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+        with open(os.path.splitext(path)[0] + '.folded', 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+
+
+_ACTIVE = None
+# Процесс - воркер пула с собственным отчетом (см. start_worker)
+_IN_WORKER = False
+
+
+def active():
+    """Текущий Report или None, если профилирование выключено."""
+    return _ACTIVE
+
+
+def phase(name):
+    """Контекст замера фазы; без активного профилирования - пустой контекст."""
+    if _ACTIVE is None:
+        return _NULL
+    return _ACTIVE.phase(name)
+
+
+def count(name, value=1):
+    if _ACTIVE is not None:
+        _ACTIVE.count(name, value)
+
+
+def profiled(name):
+    """Декоратор: весь вызов функции - фаза name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _ACTIVE is None:
+                return func(*args, **kwargs)
+            with _ACTIVE.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _start(trace_memory):
+    global _ACTIVE
+    previous = _ACTIVE
+    _ACTIVE = Report(trace_memory)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    return previous, started_tracing
+
+
+def worker_options():
+    """
+    Аргумент для инициализатора воркеров пула: None, если профилирование
+    выключено, иначе настройки отчета для start_worker.
+    """
+    return None if _ACTIVE is None else {'trace_memory': _ACTIVE.trace_memory}
+
+
+def start_worker(options):
+    """
+    Вызывается в инициализаторе воркера: с options от worker_options()
+    включает в процессе свой отчет. Воркеры завершаются через os._exit
+    (atexit не срабатывает), поэтому замеры отдаются родителю через take().
+    """
+    global _IN_WORKER
+    if options is None:
+        return
+    _start(options['trace_memory'])
+    _IN_WORKER = True
+
+
+def take():
+    """
+    В воркере - замеры с прошлого вызова (to_dict()) и новый пустой отчет;
+    вне воркера или без профилирования - None. Результат передается
+    родителю вместе с результатом задачи и добавляется через merge().
+    """
+    global _ACTIVE
+    if not _IN_WORKER or _ACTIVE is None:
+        return None
+    report = _ACTIVE
+    _ACTIVE = Report(report.trace_memory)
+    return report.to_dict()
+
+
+def merge(data):
+    """Добавляет замеры воркера (результат take()) в активный отчет."""
+    if _ACTIVE is not None and data is not None:
+        _ACTIVE.merge(data)
+
+
+@contextmanager
+def profile(trace_memory=False, output=None):
+    """
+    Включает профилирование внутри блока и отдает Report.
+    output - путь JSON, куда сохранить отчет при выходе.
+    """
+    global _ACTIVE
+    previous, started_tracing = _start(trace_memory)
+    report = _ACTIVE
+    try:
+        yield report
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _ACTIVE = previous
+        if output is not None:
+            report.save(output)
+
+
+if os.environ.get(ENV_VAR):
+    # Профилирование всего процесса, отчет пишется при завершении.
+    # Воркеры пула (spawn тоже импортирует модуль) файл не пишут - их замеры
+    # уже переданы родителю через take()
+    _start(os.environ.get(ENV_MEMORY, '') not in ('', '0'))
+    atexit.register(lambda: _ACTIVE is not None and not _IN_WORKER and _ACTIVE.save(os.environ[ENV_VAR]))
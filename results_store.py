@@ -0,0 +1,173 @@
+import json
+import os
+import sys
+import time
+from urllib.parse import quote
+
+import pandas as pd
+
+# Колоночное хранилище результатов бектестов (Parquet):
+#
+#   results/
+#       returns/strategy=<name>/data.parquet   - доходности, по файлу на стратегию
+#       returns/strategies.json                - порядок стратегий
+#       returns/checkpoints.json               - хэши параметров готовых конфигураций свипа
+#       metrics.parquet                        - таблица calculate_metrics (sl_metrics.xlsx)
+#       tail_risk.parquet                      - таблица хвостовых рисков (sl_cvar.xlsx)
+#
+# Excel остается только форматом выгрузки для стейкхолдеров (export_excel).
+
+DEFAULT_ROOT = 'results'
+TIME_COL = 'time'
+METRICS_KEY = 'Strategy'
+TAIL_RISK_KEY = 'Актив'
+
+EXCEL_FILES = {
+    'returns': 'sl_returns.xlsx',
+    'metrics': 'sl_metrics.xlsx',
+    'tail_risk': 'sl_cvar.xlsx',
+}
+
+
+def _returns_dir(root):
+    return os.path.join(root, 'returns')
+
+
+def _partition_path(root, strategy):
+    return os.path.join(_returns_dir(root), f'strategy={quote(str(strategy), safe="")}', 'data.parquet')
+
+
+def _write_parquet(df, path):
+    # Пишем во временный файл и атомарно подменяем, чтобы читатель не увидел половину файла
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.tmp{os.getpid()}'
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def write_returns(returns, root=DEFAULT_ROOT):
+    """
+    Сохраняет доходности стратегий (DatetimeIndex x стратегии),
+    по одной партиции на стратегию. Существующие партиции перезаписываются.
+    """
+    returns = returns.sort_index()
+    times = pd.DatetimeIndex(returns.index)
+    for strategy in returns.columns:
+        part = pd.DataFrame({TIME_COL: times, 'ret': returns[strategy].to_numpy()})
+        _write_parquet(part, _partition_path(root, strategy))
+
+    strategies = list_strategies(root)
+    strategies += [str(s) for s in returns.columns if str(s) not in strategies]
+    _write_json(strategies, os.path.join(_returns_dir(root), 'strategies.json'))
+
+
+def list_strategies(root=DEFAULT_ROOT):
+    """Стратегии в хранилище в порядке их записи."""
+    path = os.path.join(_returns_dir(root), 'strategies.json')
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_returns(strategies=None, root=DEFAULT_ROOT):
+    """
+    Широкая таблица доходностей с отсортированным DatetimeIndex 'time'.
+    strategies - список стратегий (None - все); читаются только их партиции.
+    """
+    if strategies is None:
+        strategies = list_strategies(root)
+    series = {}
+    for strategy in strategies:
+        part = pd.read_parquet(_partition_path(root, strategy))
+        series[strategy] = pd.Series(part['ret'].to_numpy(), index=pd.DatetimeIndex(part[TIME_COL]))
+    returns = pd.DataFrame(series)
+    returns.index.name = TIME_COL
+    return returns.sort_index()
+
+
+def _write_json(obj, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.tmp{os.getpid()}'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def load_checkpoints(root=DEFAULT_ROOT):
+    """{стратегия: хэш параметров} для конфигураций, записанных свипом."""
+    path = os.path.join(_returns_dir(root), 'checkpoints.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_checkpoint(strategy, params_hash, root=DEFAULT_ROOT):
+    """Отмечает стратегию готовой; вызывать после write_returns по ней."""
+    checkpoints = load_checkpoints(root)
+    checkpoints[str(strategy)] = params_hash
+    _write_json(checkpoints, os.path.join(_returns_dir(root), 'checkpoints.json'))
+
+
+def write_metrics(metrics, root=DEFAULT_ROOT):
+    _write_parquet(metrics.reset_index(drop=True), os.path.join(root, 'metrics.parquet'))
+
+
+def load_metrics(strategies=None, root=DEFAULT_ROOT):
+    metrics = pd.read_parquet(os.path.join(root, 'metrics.parquet'))
+    if strategies is not None:
+        metrics = metrics[metrics[METRICS_KEY].isin(strategies)].reset_index(drop=True)
+    return metrics
+
+
+def write_tail_risk(tail_risk, root=DEFAULT_ROOT):
+    _write_parquet(tail_risk.reset_index(drop=True), os.path.join(root, 'tail_risk.parquet'))
+
+
+def load_tail_risk(strategies=None, root=DEFAULT_ROOT):
+    tail_risk = pd.read_parquet(os.path.join(root, 'tail_risk.parquet'))
+    if strategies is not None:
+        tail_risk = tail_risk[tail_risk[TAIL_RISK_KEY].isin(strategies)].reset_index(drop=True)
+    return tail_risk
+
+
+def _read_excel_table(path):
+    df = pd.read_excel(path)
+    if 'Unnamed: 0' in df.columns:
+        df = df.drop(columns=['Unnamed: 0'])
+    return df
+
+
+def import_excel(root=DEFAULT_ROOT, excel_dir='.'):
+    """Разовая миграция текущих sl_*.xlsx в хранилище."""
+    returns = pd.read_excel(os.path.join(excel_dir, EXCEL_FILES['returns']))
+    returns[TIME_COL] = pd.to_datetime(returns[TIME_COL], errors='coerce')
+    returns = returns.dropna(subset=[TIME_COL]).set_index(TIME_COL)
+    write_returns(returns.select_dtypes(include='number'), root)
+    write_metrics(_read_excel_table(os.path.join(excel_dir, EXCEL_FILES['metrics'])), root)
+    write_tail_risk(_read_excel_table(os.path.join(excel_dir, EXCEL_FILES['tail_risk'])), root)
+
+
+def export_excel(root=DEFAULT_ROOT, excel_dir='.'):
+    """Выгрузка хранилища в Excel в прежнем формате sl_returns / sl_metrics / sl_cvar."""
+    os.makedirs(excel_dir, exist_ok=True)
+    returns = load_returns(root=root).reset_index()
+    returns.to_excel(os.path.join(excel_dir, EXCEL_FILES['returns']), index=False)
+    load_metrics(root=root).to_excel(os.path.join(excel_dir, EXCEL_FILES['metrics']))
+    load_tail_risk(root=root).to_excel(os.path.join(excel_dir, EXCEL_FILES['tail_risk']))
+
+
+if __name__ == '__main__':
+    # python results_store.py import|export [root] [excel_dir]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'import'
+    root = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_ROOT
+    excel_dir = sys.argv[3] if len(sys.argv) > 3 else '.'
+    start = time.time()
+    if command == 'import':
+        import_excel(root, excel_dir)
+    elif command == 'export':
+        export_excel(root, excel_dir)
+    else:
+        raise SystemExit(f'Unknown command: {command}')
+    print(f'{command}: {time.time() - start:.2f} s')
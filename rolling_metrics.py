@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+
+from metrics_core import BENCHMARK_RATES, _matrix, resolve_periods, wealth
+
+try:
+    from numba import njit
+except ImportError:  # numba не установлена - цикл по дэку на чистом python
+    njit = None
+
+# Скользящие и накопительные (expanding) метрики по всем стратегиям сразу.
+# Среднее, std и downside-отклонение - через префиксные суммы (O(n) на
+# колонку при любом окне), пик капитала для просадки - через монотонный дэк.
+# Все ряды выровнены по индексу returns.
+
+ROLLING_METRICS = ['sharpe', 'sortino', 'volatility', 'drawdown']
+
+
+def window_starts(index, window):
+    """
+    Позиция первого бара окна для каждого бара.
+    window - число баров, смещение по времени ('30D', pd.Timedelta)
+    или None (expanding: окно от начала истории).
+    """
+    n = len(index)
+    if window is None:
+        return np.zeros(n, dtype=np.int64)
+    if isinstance(window, (int, np.integer)):
+        return np.maximum(0, np.arange(n) - int(window) + 1).astype(np.int64)
+    # Временное окно (t - window, t], индекс должен быть отсортирован
+    index = pd.DatetimeIndex(index)
+    return index.searchsorted(index - pd.Timedelta(window), side='right').astype(np.int64)
+
+
+def _running_max_loop(values, starts, out):
+    # Монотонный дэк индексов: значения в нем убывают, голова - максимум окна
+    n, k = values.shape
+    queue = np.empty(n, dtype=np.int64)
+    for j in range(k):
+        head = 0
+        tail = 0
+        for i in range(n):
+            v = values[i, j]
+            while tail > head and values[queue[tail - 1], j] <= v:
+                tail -= 1
+            queue[tail] = i
+            tail += 1
+            while queue[head] < starts[i]:
+                head += 1
+            out[i, j] = values[queue[head], j]
+
+
+if njit is not None:
+    _running_max_kernel = njit(cache=True)(_running_max_loop)
+else:
+    _running_max_kernel = _running_max_loop
+
+
+def running_max(values, starts):
+    """Максимум values[starts[i]:i + 1] по каждой колонке, O(n) на колонку."""
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    if not starts.any():
+        # expanding - обычный накопительный максимум
+        return np.maximum.accumulate(values, axis=0)
+    out = np.empty_like(values)
+    _running_max_kernel(values, np.ascontiguousarray(starts, dtype=np.int64), out)
+    return out
+
+
+def _window_sums(prefix, starts):
+    # Сумма по окну [starts[i], i] из префиксных сумм (n + 1, k)
+    return prefix[1:] - prefix[starts]
+
+
+def _prefix(values):
+    return np.vstack([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+
+
+class WindowMoments:
+    """
+    Число наблюдений, среднее и std (ddof=1) колонок values на окнах
+    [start, end) по префиксным суммам: O(k) на окно после O(n * k) подготовки.
+    NaN в values пропускаются.
+    """
+
+    def __init__(self, values):
+        valid = ~np.isnan(values)
+        # Центрирование средним колонки уменьшает потерю точности в S2 - S1^2 / c
+        with np.errstate(invalid='ignore'):
+            shift = np.nanmean(values, axis=0) if len(values) else np.zeros(values.shape[1])
+        self.shift = np.nan_to_num(shift)
+        centered = np.where(valid, values - self.shift, 0.0)
+        self.count = _prefix(valid.astype(np.float64))
+        self.s1 = _prefix(centered)
+        self.s2 = _prefix(centered ** 2)
+
+    def __call__(self, starts, ends):
+        """(count, mean, std) окон; starts / ends - позиции или массивы позиций."""
+        count = self.count[ends] - self.count[starts]
+        s1 = self.s1[ends] - self.s1[starts]
+        s2 = self.s2[ends] - self.s2[starts]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = s1 / count + self.shift
+            std = np.sqrt(np.maximum(s2 - s1 ** 2 / count, 0.0) / (count - 1))
+        return count, mean, std
+
+
+def rolling_metrics(returns, window='30D', periods=None, risk_free_rate=None, min_periods=2):
+    """
+    Скользящие Sharpe, Sortino, волатильность и просадка для всех колонок returns.
+
+    window         - число баров, смещение по времени ('30D') или None (expanding)
+    periods        - баров в году для аннуализации (None - по шагу индекса)
+    risk_free_rate - годовая ставка для Sharpe/Sortino (по умолчанию US Treasury)
+    min_periods    - минимум наблюдений в окне, иначе NaN
+
+    Возвращает {метрика: DataFrame} с индексом и колонками returns.
+    Просадка - (пик - капитал) / пик, где пик - максимум капитала в окне.
+    """
+    if risk_free_rate is None:
+        risk_free_rate = BENCHMARK_RATES['US Treasury']
+    returns = returns.sort_index()
+    periods = resolve_periods(periods, returns.index)
+    values = _matrix(returns)
+    starts = window_starts(returns.index, window)
+    valid = ~np.isnan(values)
+    excess_rate = risk_free_rate / periods
+
+    count, mean, std = WindowMoments(values)(starts, np.arange(1, len(values) + 1))
+    downside = np.where(valid, np.minimum(0, values - excess_rate), 0.0) ** 2
+    d2 = _window_sums(_prefix(downside), starts)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        enough = count >= max(min_periods, 2)
+        sharpe = np.sqrt(periods) * (mean - excess_rate) / std
+        downside_dev = np.sqrt(d2 / count) * np.sqrt(periods)
+        sortino = np.where(downside_dev != 0, (mean - excess_rate) * periods / downside_dev, np.nan)
+
+        cumulative = wealth(values)
+        peak = running_max(cumulative, starts)
+        drawdown = (peak - cumulative) / peak
+
+    frames = {
+        'sharpe': np.where(enough, sharpe, np.nan),
+        'sortino': np.where(enough, sortino, np.nan),
+        'volatility': np.where(enough, std * np.sqrt(periods), np.nan),
+        'drawdown': drawdown,
+    }
+    return {name: pd.DataFrame(frames[name], index=returns.index, columns=returns.columns)
+            for name in ROLLING_METRICS}
+
+
+def expanding_metrics(returns, periods=None, risk_free_rate=None, min_periods=2):
+    """Накопительные метрики: окно от начала истории до каждого бара."""
+    return rolling_metrics(returns, None, periods, risk_free_rate, min_periods)
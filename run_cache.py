@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import uuid
+
+import numpy as np
+
+from backtester import (ENGINE_VERSION, _output_columns, _prepare_inputs, _result_frame,
+                        _simulate)
+
+# Дисковый кэш результатов run_strategy с адресацией по содержимому.
+#
+#   <root>/<key>.npy - блок служебных колонок (бары x колонки), float64
+#
+# key - хэш входных колонок (и индекса) после обрезки по первому валидному
+# бару, всех параметров стратегии, набора колонок и ENGINE_VERSION.
+# Попадание читается через np.load(mmap_mode='r') без пересчета.
+
+DEFAULT_ROOT = '.run_cache'
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# Входные массивы, от которых зависит результат
+_INPUT_KEYS = ['lst', 'hedge', 'cross', 'funding', 'lst_ret_raw', 'hedge_ret_raw']
+
+
+def cache_key(inputs, params, columns):
+    """Хэш данных, параметров, колонок результата и версии движка."""
+    digest = hashlib.blake2b(digest_size=20)
+    header = {'engine_version': ENGINE_VERSION, 'params': params, 'columns': list(columns)}
+    digest.update(json.dumps(header, sort_keys=True, default=str).encode('utf-8'))
+    index = inputs['data'].index
+    digest.update(str(getattr(index, 'tz', None)).encode('utf-8'))
+    digest.update(np.ascontiguousarray(index.asi8).tobytes())
+    for name in _INPUT_KEYS:
+        digest.update(inputs[name].tobytes())
+    return digest.hexdigest()
+
+
+class RunCache:
+    """
+    Мемоизация run_strategy на диске с ограничением размера (LRU).
+
+        cache = RunCache()
+        result = cache.run_strategy(data, lst_token='meth', ...)
+
+    Сигнатура та же, что у backtester.run_strategy. При попадании служебные
+    колонки лежат поверх memory-mapped файла (только чтение); в режиме
+    outputs='full' они склеиваются с входными колонками (это копия).
+    Порядок LRU - по mtime файла, он обновляется при каждом попадании.
+    """
+
+    def __init__(self, root=DEFAULT_ROOT, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, f'{key}.npy')
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            values = np.load(path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None
+        os.utime(path)
+        return values
+
+    def _store(self, key, values):
+        # Пишем во временный файл и атомарно подменяем
+        tmp = os.path.join(self.root, f'.tmp-{uuid.uuid4().hex}.npy')
+        np.save(tmp, np.ascontiguousarray(values))
+        os.replace(tmp, self._path(key))
+        self.evict()
+
+    def entries(self):
+        """[(mtime, размер в байтах, путь)] по всем записям, давно использованные первыми."""
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith('.npy') and not entry.name.startswith('.tmp-'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def evict(self):
+        """Удаляет давно использованные записи, пока кэш больше max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
+
+    def run_strategy(self, data, lst_token, lst_token_ret, hedge_token, hedge_token_ret, cross_token,
+                     funding_type, strategy_type, deviation, init_capital, fut_fees, spot_fees,
+                     lst_collateral=1, rebalance_hours=None, start_hour=0, cross_ex=0, outputs='full',
+                     engine='loop'):
+        columns = _output_columns(outputs)
+        inputs = _prepare_inputs(data, lst_token, lst_token_ret, hedge_token, hedge_token_ret,
+                                 cross_token, funding_type, cross_ex)
+        params = dict(strategy_type=strategy_type, deviation=deviation, init_capital=init_capital,
+                      fut_fees=fut_fees, spot_fees=spot_fees, lst_collateral=lst_collateral,
+                      rebalance_hours=rebalance_hours, start_hour=start_hour, cross_ex=cross_ex)
+        key = cache_key(inputs, params, columns)
+
+        values = self._load(key)
+        if values is None:
+            # engine не входит в ключ: результат движков одинаковый
+            out, _ = _simulate(inputs, columns, engine=engine, **params)
+            self._store(key, out.T)
+            values = out.T
+        return _result_frame(inputs['data'], lst_token, inputs['lst_ex'], values.T, columns)
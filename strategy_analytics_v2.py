@@ -1,13 +1,16 @@
 import pandas as pd
 import time
-import matplotlib.pyplot as plt
 import numpy as np
-import matplotlib.dates as mdates
 import math
-from scipy.stats import kurtosis, norm, skew
-from var import VaR
 
+import profiling
+from metrics_core import metrics_table, monthly_returns, resolve_benchmarks, resolve_periods
+from tail_risk import rolling
+
+@profiling.profiled('figure:leverage_analysis')
 def leverage_analysis(df, strategy_name='every_day', hedge_token='SOL', hedge_token_price='sol_close'):
+    import matplotlib.pyplot as plt
+
     fig, ax1 = plt.subplots(figsize=(10, 6))
     
     # Получаем начальные значения
@@ -48,7 +51,10 @@ def leverage_analysis(df, strategy_name='every_day', hedge_token='SOL', hedge_to
     plt.show()
 
 
+@profiling.profiled('figure:pnl_decompose')
 def pnl_decompose(df, resample='W', bar_width = 1.5, strategy_name = 'every_day'):
+    import matplotlib.dates as mdates
+    import matplotlib.pyplot as plt
     
     pnl_df = df[['lst_pnl', 'fund_pnl', 'hedge_pnl', 'total_pnl', 'capital']]
     pnl_df['net_pnl'] = ((pnl_df['lst_pnl'] + pnl_df['hedge_pnl']) / pnl_df['capital'].shift()).fillna(0)
@@ -127,7 +133,9 @@ def pnl_decompose(df, resample='W', bar_width = 1.5, strategy_name = 'every_day'
     plt.show()
     
 
+@profiling.profiled('figure:fees_decompose')
 def fees_decompose(df, strategy_name = 'every_day'):
+    import matplotlib.pyplot as plt
     
     cost_df = df[['lst_fees', 'hedge_fees', 'total_fees', 'capital']]
     cost_df['lst_fees'] = -cost_df['lst_fees'] / cost_df['capital'].shift()
@@ -184,28 +192,31 @@ def fees_decompose(df, strategy_name = 'every_day'):
     plt.show()
 
 # Sharpe Ratio (годовой)
-def sharpe_ratio(returns, risk_free=0, periods=365):
+def sharpe_ratio(returns, risk_free=0, periods=None):
     returns = pd.Series(returns)
+    periods = resolve_periods(periods, returns.index)
     excess_returns = returns - risk_free / periods
     return np.sqrt(periods) * excess_returns.mean() / excess_returns.std()
 
 # Sortino Ratio (годовой)
-def sortino_ratio(returns, risk_free=0, periods=365):
+def sortino_ratio(returns, risk_free=0, periods=None):
     returns = pd.Series(returns)
+    periods = resolve_periods(periods, returns.index)
     excess_returns = returns - risk_free / periods
     downside_deviation = np.sqrt((np.minimum(0, excess_returns)**2).mean()) * np.sqrt(periods)
     return (excess_returns.mean() * periods) / downside_deviation if downside_deviation != 0 else np.nan
 
 # Annualized Volatility
-def annualized_volatility(returns, periods=365):
+def annualized_volatility(returns, periods=None):
+    periods = resolve_periods(periods, returns.index)
     return returns.std() * np.sqrt(periods)
 
 # Best/Worst Month
 def best_worst_month(returns):
-    monthly = returns.resample('M').apply(lambda x: (1 + x).prod() - 1)
+    _, monthly = monthly_returns(returns.to_numpy(dtype=np.float64).reshape(-1, 1), returns.index)
     return {
-        'Best Month': monthly.max(),
-        'Worst Month': monthly.min()
+        'Best Month': np.nanmax(monthly[:, 0]),
+        'Worst Month': np.nanmin(monthly[:, 0])
     }
 
 # Monthly Turnover (пример: если у вас есть веса позиций)
@@ -218,8 +229,8 @@ def monthly_turnover(weights_df):
 
 # Monthly Return
 def monthly_return(returns):
-    monthly = returns.resample('M').apply(lambda x: (1 + x).prod() - 1)
-    return monthly.mean()
+    _, monthly = monthly_returns(returns.to_numpy(dtype=np.float64).reshape(-1, 1), returns.index)
+    return np.nanmean(monthly[:, 0])
 
 # Total Return
 def total_return(returns):
@@ -232,56 +243,38 @@ def max_drawdown(series):
     drawdown = (peak - cumulative) / peak
     return drawdown.max()
 
-def cvar(series):   
-   var = VaR(pd.DataFrame(series), weights=np.array([1]))
-   var_h = var.backtest(method='h')
-   return var_h['ES(95.0)'].iloc[-1]*100
+@profiling.profiled('cvar')
+def cvar(series):
+   # Прогноз исторического ES(95%) на последний бар, в процентах (как var.backtest)
+   _, es = rolling(pd.DataFrame(series), levels=(0.95,))
+   return es[0.95].iloc[-1, 0]*100
     
 
-def calculate_metrics(df_returns, weights_df=None, risk_free_rate=0.047, periods=365):
+@profiling.profiled('calculate_metrics')
+def calculate_metrics(df_returns, weights_df=None, risk_free_rate=None, periods=None, benchmarks=None, resample=None):
     """
-    df_returns - DataFrame с дневными доходностями стратегий (колонки - стратегии)
+    df_returns - DataFrame с доходностями стратегий (колонки - стратегии, шаг любой)
     weights_df - DataFrame с весами позиций (опционально, для turnover)
-    risk_free_rate - безрисковая ставка
+    risk_free_rate - безрисковая ставка (бенчмарк 'US Treasury');
+                     None - ставка из реестра
+    benchmarks - реестр бенчмарков {имя: ставка или ряд ставок};
+                 по умолчанию читается из benchmark_rates.json
+    periods - баров в году; None - по шагу индекса (часовые бары - 8760)
+    resample - правило pandas ('D'), если метрики нужны на более крупном шаге:
+               ресемплинг делается один раз для всех метрик
+
+    Все метрики считаются сразу по всей матрице доходностей (metrics_core):
+    моменты - один раз на колонку для всех ставок, месячные доходности -
+    одной групповой суммой log(1 + r).
     """
-    results = []
-
-    for col in df_returns.columns:
-        returns = df_returns[col].dropna()
-        metrics = {
-            'Strategy': col,
-            'Sharpe Ratio (US Treasury)': sharpe_ratio(returns, risk_free_rate, periods),
-            'Sharpe Ratio (AAVE)': sharpe_ratio(returns, 0.0677, periods),
-            'Sharpe Ratio (Coinbase)': sharpe_ratio(returns, 0.06, periods),
-            'Sharpe Ratio (Lido)': sharpe_ratio(returns, 0.028, periods),
-            'Sharpe Ratio (Jupiter)': sharpe_ratio(returns, 0.0211, periods),
-            'Sharpe Ratio (Kamino)': sharpe_ratio(returns, 0.0721, periods),
-            'Sortino Ratio (US Treasury)': sortino_ratio(returns, risk_free_rate, periods),
-            'Sortino Ratio (AAVE)': sortino_ratio(returns, 0.0677, periods),
-            'Sortino Ratio (Coinbase)': sortino_ratio(returns, 0.06, periods),
-            'Sortino Ratio (Lido)': sortino_ratio(returns, 0.028, periods),
-            'Sortino Ratio (Jupiter)': sortino_ratio(returns, 0.0211, periods),
-            'Sortino Ratio (Kamino)': sortino_ratio(returns, 0.0721, periods),
-            'Volatility (ann)': annualized_volatility(returns, periods),
-            'Max Drawdown': max_drawdown(returns),
-            'Total Return': total_return(returns),
-            'Monthly Return': monthly_return(returns),
-        }
-
-        # Best/Worst Month
-        bw = best_worst_month(returns)
-        metrics.update(bw)
-
-        # Monthly Turnover (если передан weights_df)
-        if weights_df is not None and col in weights_df.columns:
-            turnover = monthly_turnover(weights_df[[col]])
-            metrics['Monthly Turnover'] = turnover
-        else:
-            metrics['Monthly Turnover'] = np.nan
-
-        results.append(metrics)
-
-    df_metrics = pd.DataFrame(results)
+    benchmarks = resolve_benchmarks(benchmarks, risk_free_rate)
+    df_metrics = metrics_table(df_returns, benchmarks, periods, resample)
+
+    # Monthly Turnover (если передан weights_df)
+    df_metrics['Monthly Turnover'] = [
+        monthly_turnover(weights_df[[col]]) if weights_df is not None and col in weights_df.columns else np.nan
+        for col in df_returns.columns
+    ]
     return df_metrics
 
 
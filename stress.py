@@ -0,0 +1,238 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import profiling
+from backtester import _prepare_inputs, _simulate_batch, _time_rebalance_mask, strategy_code
+
+# Стресс-тест стратегии на синтетических траекториях (Монте-Карло).
+#
+# Траектории строятся из исторических часовых данных: блочный бутстрап
+# лог-доходностей lst и hedge, фандинга и базиса cross/hedge (одни и те же
+# блоки для всех рядов - корреляции сохраняются; базис берется уровнем, а не
+# накапливается, чтобы спот не уходил от фьючерса), плюс шоки:
+#   - режим фандинга: на случайном отрезке фандинг умножается на funding_shock_mult
+#   - депег: lst падает на depeg_size и линейно восстанавливается
+#     за depeg_recovery_hours (соотношение lst/hedge отходит от пега)
+#
+# Рекурсия ребалансировки - та же, что в run_grid (_simulate_batch), сразу
+# по всем траекториям пачки (массивы бары x траектории); пачки раздаются
+# пулу процессов.
+# Одинаковый seed дает одинаковые траектории при любом числе процессов,
+# поэтому конфигурации можно сравнивать на общем наборе сценариев.
+
+RESULT_COLUMNS = ['final_capital', 'max_drawdown', 'peak_leverage', 'total_fees', 'rebalances']
+
+DEFAULT_SHOCKS = {
+    'block_hours': 24 * 7,           # длина блока бутстрапа
+    'align_hours': 24,               # блоки начинаются в тот же час суток (сетка фандинга)
+    'funding_shock_prob': 0.2,       # доля траекторий с шоком фандинга
+    'funding_shock_hours': 24 * 30,
+    'funding_shock_mult': -1.0,      # -1 - фандинг меняет знак
+    'depeg_prob': 0.1,               # доля траекторий с депегом
+    'depeg_size': 0.05,              # падение lst относительно hedge
+    'depeg_recovery_hours': 24 * 14,  # None - без восстановления
+}
+
+DEFAULT_QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+def _log_returns(values):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nan_to_num(np.diff(np.log(values)), nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def history_base(inputs):
+    """Исторические ряды для бутстрапа из входных массивов run_strategy."""
+    return {
+        'lst0': inputs['lst'][0],
+        'hedge0': inputs['hedge'][0],
+        'cross0': inputs['cross'][0],
+        'lst_lr': _log_returns(inputs['lst']),
+        'hedge_lr': _log_returns(inputs['hedge']),
+        'basis': np.nan_to_num(inputs['cross'][1:] / inputs['hedge'][1:], nan=1.0),
+        'funding': np.nan_to_num(inputs['funding'][1:], nan=0.0),
+    }
+
+
+def _bootstrap_index(m, n_paths, rng, block_hours, align_hours):
+    # Блоки фиксированной длины по кругу; начало блока сдвигается назад
+    # до того же часа суток, что и позиция, куда блок встает
+    n_blocks = -(-m // block_hours)
+    starts = rng.integers(0, m, size=(n_blocks, n_paths))
+    if align_hours:
+        positions = (np.arange(n_blocks) * block_hours)[:, None]
+        starts = starts - (starts - positions) % align_hours
+    index = (starts[:, None, :] + np.arange(block_hours)[None, :, None]) % m
+    return index.reshape(n_blocks * block_hours, n_paths)[:m]
+
+
+def _shock_window(n, n_paths, rng, prob):
+    # (попадание, начало) шока для каждой траектории
+    hit = rng.random(n_paths) < prob
+    start = rng.integers(1, max(n, 2), size=n_paths)
+    return hit, start
+
+
+def generate_paths(base, n_paths, rng, block_hours=DEFAULT_SHOCKS['block_hours'],
+                   align_hours=DEFAULT_SHOCKS['align_hours'],
+                   funding_shock_prob=DEFAULT_SHOCKS['funding_shock_prob'],
+                   funding_shock_hours=DEFAULT_SHOCKS['funding_shock_hours'],
+                   funding_shock_mult=DEFAULT_SHOCKS['funding_shock_mult'],
+                   depeg_prob=DEFAULT_SHOCKS['depeg_prob'],
+                   depeg_size=DEFAULT_SHOCKS['depeg_size'],
+                   depeg_recovery_hours=DEFAULT_SHOCKS['depeg_recovery_hours']):
+    """
+    n_paths синтетических траекторий длины истории.
+    Возвращает словарь массивов (бары x траектории): lst, hedge, cross, funding, hedge_ret_raw.
+    """
+    m = len(base['funding'])
+    n = m + 1
+    index = _bootstrap_index(m, n_paths, rng, block_hours, align_hours)
+
+    def prices(start, log_returns):
+        path = np.empty((n, n_paths))
+        path[0] = start
+        path[1:] = start * np.exp(np.cumsum(log_returns[index], axis=0))
+        return path
+
+    lst = prices(base['lst0'], base['lst_lr'])
+    hedge = prices(base['hedge0'], base['hedge_lr'])
+    cross = np.empty((n, n_paths))
+    cross[0] = base['cross0']
+    cross[1:] = hedge[1:] * base['basis'][index]
+    funding = np.zeros((n, n_paths))
+    funding[1:] = base['funding'][index]
+    bars = np.arange(n)[:, None]
+
+    hit, start = _shock_window(n, n_paths, rng, funding_shock_prob)
+    regime = hit & (bars >= start) & (bars < start + funding_shock_hours)
+    funding = np.where(regime, funding * funding_shock_mult, funding)
+
+    hit, start = _shock_window(n, n_paths, rng, depeg_prob)
+    elapsed = bars - start
+    if depeg_recovery_hours:
+        remaining = np.clip(1 - elapsed / depeg_recovery_hours, 0.0, 1.0)
+    else:
+        remaining = 1.0
+    lst = lst * (1 - np.where(hit & (elapsed >= 0), depeg_size * remaining, 0.0))
+
+    hedge_ret_raw = np.zeros_like(hedge)
+    hedge_ret_raw[1:] = hedge[1:] / hedge[:-1] - 1
+    return {'lst': lst, 'hedge': hedge, 'cross': cross, 'funding': funding, 'hedge_ret_raw': hedge_ret_raw}
+
+
+def simulate_paths(paths, time_reb, strategy_type, deviation, init_capital, fut_fees, spot_fees,
+                   lst_collateral=1, cross_ex=0):
+    """
+    Рекурсия run_grid (_simulate_batch) для всех траекторий сразу: каждая
+    траектория - отдельный прогон со своими рядами. На исторической
+    траектории совпадает с run_strategy.
+    Возвращает DataFrame (траектории x RESULT_COLUMNS).
+    """
+    cross_mult = np.maximum(1, (cross_ex * paths['cross']))
+    inputs = {
+        'lst': paths['lst'],
+        'hedge': paths['hedge'],
+        'cross_mult': cross_mult,
+        'lst_ex': paths['lst'] * cross_mult / paths['hedge'],
+        'hedge_ret_raw': paths['hedge_ret_raw'],
+        'funding': paths['funding'],
+    }
+    n_paths = paths['lst'].shape[1]
+    codes = np.full(n_paths, strategy_code(strategy_type), dtype=np.int64)
+    deviations = np.full(n_paths, deviation, dtype=np.float64)
+    totals = _simulate_batch(inputs, codes, deviations, time_reb, init_capital, fut_fees, spot_fees,
+                             lst_collateral, cross_ex, aggregates=True)
+    return pd.DataFrame(totals, columns=RESULT_COLUMNS)
+
+
+_WORKER = {}
+
+
+def _init_worker(base, time_reb, strategy, shocks, profile=None):
+    _WORKER.update(base=base, time_reb=time_reb, strategy=strategy, shocks=shocks)
+    profiling.start_worker(profile)
+
+
+def _run_batch(seed_sequence, n_paths):
+    # Траектории генерируются в воркере: между процессами идут только seed,
+    # итоги и замеры профилирования пачки
+    rng = np.random.default_rng(seed_sequence)
+    with profiling.phase('generate_paths'):
+        paths = generate_paths(_WORKER['base'], n_paths, rng, **_WORKER['shocks'])
+    with profiling.phase('simulate_paths'):
+        results = simulate_paths(paths, _WORKER['time_reb'], **_WORKER['strategy'])
+    return results, profiling.take()
+
+
+def stress_test(
+    data,
+    lst_token,
+    lst_token_ret,
+    hedge_token,
+    hedge_token_ret,
+    cross_token,
+    funding_type,
+    strategy_type,
+    deviation,
+    init_capital,
+    fut_fees,
+    spot_fees,
+    lst_collateral=1,
+    rebalance_hours=None,
+    start_hour=0,
+    cross_ex=0,
+    n_paths=1000,
+    seed=0,
+    batch_size=256,
+    processes=None,
+    **shocks
+):
+    """
+    Прогон конфигурации run_strategy на n_paths синтетических траекториях.
+
+    shocks     - параметры generate_paths (см. DEFAULT_SHOCKS)
+    batch_size - траекторий в пачке (память: ~6 массивов бары x batch_size)
+    processes  - число процессов; 1 - без пула (по умолчанию пул, если пачек больше одной)
+
+    Возвращает DataFrame (траектории x RESULT_COLUMNS): итоговый капитал,
+    максимальная просадка капитала, пиковое плечо, сумма комиссий, число ребалансировок.
+    """
+    unknown = set(shocks) - set(DEFAULT_SHOCKS)
+    if unknown:
+        raise ValueError(f'Unknown shock parameters: {sorted(unknown)}')
+    shocks = dict(DEFAULT_SHOCKS, **shocks)
+    inputs = _prepare_inputs(data, lst_token, lst_token_ret, hedge_token, hedge_token_ret,
+                             cross_token, funding_type, cross_ex)
+    base = history_base(inputs)
+    time_reb = _time_rebalance_mask(inputs['data'].index, rebalance_hours, start_hour)
+    strategy = dict(strategy_type=strategy_type, deviation=deviation, init_capital=init_capital,
+                    fut_fees=fut_fees, spot_fees=spot_fees, lst_collateral=lst_collateral, cross_ex=cross_ex)
+
+    sizes = [min(batch_size, n_paths - start) for start in range(0, n_paths, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if processes == 1 or len(sizes) <= 1:
+        _init_worker(base, time_reb, strategy, shocks)
+        batches = [_run_batch(s, size)[0] for s, size in zip(seeds, sizes)]
+    else:
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(base, time_reb, strategy, shocks,
+                                           profiling.worker_options())) as pool:
+            batches = []
+            for results, profile in pool.map(_run_batch, seeds, sizes):
+                profiling.merge(profile)
+                batches.append(results)
+    results = pd.concat(batches, ignore_index=True) if batches else pd.DataFrame(columns=RESULT_COLUMNS)
+    results.index.name = 'path'
+    return results
+
+
+def stress_summary(results, quantiles=DEFAULT_QUANTILES):
+    """Квантили распределений по траекториям (метрики x квантили) и среднее."""
+    summary = results.quantile(list(quantiles)).T
+    summary.columns = [f'q{q:g}' for q in quantiles]
+    summary.insert(0, 'mean', results.mean())
+    return summary
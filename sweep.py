@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import profiling
+import results_store
+from backtester import config_name, run_strategy
+
+# Колонки конфигурации, которые ссылаются на колонки входных данных
+DATA_KEYS = ['lst_token', 'lst_token_ret', 'hedge_token', 'hedge_token_ret', 'cross_token', 'funding_type']
+
+
+class SharedFrame:
+    """
+    Числовые колонки DataFrame в одном блоке multiprocessing.shared_memory.
+
+    Воркерам передается только spec (имя блока, форма, колонки), а не
+    pickle-копия многолетнего DataFrame. Индекс (DatetimeIndex) хранится
+    в том же блоке как int64 наносекунды.
+    """
+
+    def __init__(self, data, columns):
+        columns = list(dict.fromkeys(columns))
+        values = data[columns].to_numpy(dtype=np.float64)
+        index = data.index
+        n, k = values.shape
+        self.shm = shared_memory.SharedMemory(create=True, size=max(8 * n * (k + 1), 8))
+        block = np.ndarray((n, k + 1), dtype=np.float64, buffer=self.shm.buf)
+        block[:, :k] = values
+        block[:, k] = np.asarray(index.asi8, dtype=np.int64).view(np.float64)
+        self.spec = {
+            'name': self.shm.name,
+            'shape': (n, k),
+            'columns': columns,
+            'index_name': index.name,
+            'tz': str(index.tz) if index.tz is not None else None,
+        }
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach_frame(spec):
+    """Собирает DataFrame поверх общего блока памяти без копирования данных."""
+    # Блоком владеет родительский процесс: воркеры пула используют его
+    # resource_tracker, поэтому повторная регистрация ничего не удаляет
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=spec['name'], track=False)
+    else:
+        shm = shared_memory.SharedMemory(name=spec['name'])
+    n, k = spec['shape']
+    block = np.ndarray((n, k + 1), dtype=np.float64, buffer=shm.buf)
+    index = pd.DatetimeIndex(block[:, k].view(np.int64), name=spec['index_name'])
+    if spec['tz'] is not None:
+        index = index.tz_localize('UTC').tz_convert(spec['tz'])
+    frame = pd.DataFrame(block[:, :k], index=index, columns=spec['columns'], copy=False)
+    return shm, frame
+
+
+_WORKER = {}
+
+
+def _init_worker(spec, profile=None):
+    # Подключаемся к общему блоку один раз на процесс
+    _WORKER['shm'], _WORKER['frame'] = attach_frame(spec)
+    profiling.start_worker(profile)
+
+
+def _run_config(name, params, columns):
+    # Замеры профилирования конфигурации возвращаются вместе с результатом
+    try:
+        if columns is not None:
+            # Считаем и возвращаем только нужные колонки
+            params = dict(params, outputs=params.get('outputs', list(columns)))
+        result = run_strategy(_WORKER['frame'], **params)
+        if columns is not None:
+            result = result[list(columns)]
+        return name, result, None, profiling.take()
+    except Exception:
+        return name, None, traceback.format_exc(), profiling.take()
+
+
+def sweep_config_name(params):
+    """Имя конфигурации по умолчанию: пара токенов + имя в формате sl_returns."""
+    name = config_name(params['strategy_type'], params.get('deviation'),
+                       params.get('rebalance_hours'), params.get('start_hour', 0))
+    return f"{params['lst_token']}-{params['hedge_token']}-{params['funding_type']}_{name}"
+
+
+def print_progress(done, total, name, error):
+    status = 'FAILED' if error is not None else 'ok'
+    print(f'[{done}/{total}] {name}: {status}', flush=True)
+
+
+def iter_sweep(data, configs, processes=None, columns=('strategy_ret',), progress=None):
+    """
+    Параллельный прогон run_strategy по списку конфигураций.
+
+    configs   - список словарей с аргументами run_strategy (кроме data);
+                необязательный ключ 'name' задает имя результата
+    processes - число процессов (по умолчанию - все ядра)
+    columns   - какие колонки результата возвращать (None - весь DataFrame)
+    progress  - callback(done, total, name, error) после каждой конфигурации
+
+    Генератор отдает (name, result, error) по мере завершения конфигураций.
+    Ошибка в одной конфигурации не прерывает прогон: result=None, error - traceback.
+    """
+    configs = list(configs)
+    named = []
+    for params in configs:
+        params = dict(params)
+        name = params.pop('name', None) or sweep_config_name(params)
+        named.append((name, params))
+    # В общую память кладем только колонки, на которые ссылаются конфигурации
+    data_columns = [params[key] for _, params in named for key in DATA_KEYS
+                    if params.get(key) in data.columns]
+
+    total = len(named)
+    done = 0
+    with SharedFrame(data, data_columns) as shared:
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count(),
+                                 initializer=_init_worker,
+                                 initargs=(shared.spec, profiling.worker_options())) as pool:
+            futures = [pool.submit(_run_config, name, params, columns) for name, params in named]
+            for future in as_completed(futures):
+                name, result, error, profile = future.result()
+                profiling.merge(profile)
+                done += 1
+                if progress is not None:
+                    progress(done, total, name, error)
+                yield name, result, error
+
+
+def run_sweep(data, configs, processes=None, column='strategy_ret', progress=print_progress):
+    """
+    Собирает результаты iter_sweep в широкую таблицу.
+
+    Возвращает (returns, errors): returns - DataFrame с колонкой column каждой
+    успешной конфигурации, errors - {name: traceback} для упавших.
+    """
+    results = {}
+    errors = {}
+    for name, result, error in iter_sweep(data, configs, processes, (column,), progress):
+        if error is not None:
+            errors[name] = error
+        else:
+            results[name] = result[column]
+    names = [n for n in (params.get('name') or sweep_config_name(params) for params in configs) if n in results]
+    returns = pd.DataFrame({name: results[name] for name in names})
+    return returns, errors
+
+
+def params_hash(params, column='strategy_ret'):
+    """Хэш параметров конфигурации (без имени) и сохраняемой колонки."""
+    params = {key: value for key, value in params.items() if key != 'name'}
+    payload = json.dumps({'params': params, 'column': column}, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def resume_sweep(data, configs, root=results_store.DEFAULT_ROOT, processes=None,
+                 column='strategy_ret', progress=print_progress):
+    """
+    Свип с сохранением по ходу: результат каждой конфигурации сразу пишется
+    в хранилище results_store (партиция стратегии + хэш параметров).
+
+    При перезапуске конфигурации, у которых в хранилище тот же хэш
+    параметров, пропускаются; упавшие считаются заново. Пока свип идет,
+    готовые результаты доступны через results_store.load_returns(root=root).
+    Хэш не учитывает сами данные: для других данных нужен другой root.
+
+    Возвращает (returns, errors) как run_sweep - по всем готовым конфигурациям.
+    """
+    named = [(params.get('name') or sweep_config_name(params), params) for params in configs]
+    checkpoints = results_store.load_checkpoints(root)
+    hashes = {name: params_hash(params, column) for name, params in named}
+    todo = [dict(params, name=name) for name, params in named if checkpoints.get(name) != hashes[name]]
+
+    errors = {}
+    if todo:
+        for name, result, error in iter_sweep(data, todo, processes, (column,), progress):
+            if error is not None:
+                errors[name] = error
+                continue
+            # Сначала данные, потом отметка: при обрыве между ними конфигурация пересчитается
+            results_store.write_returns(result[[column]].rename(columns={column: name}), root)
+            results_store.write_checkpoint(name, hashes[name], root)
+
+    checkpoints = results_store.load_checkpoints(root)
+    done = [name for name, _ in named if checkpoints.get(name) == hashes[name]]
+    return results_store.load_returns(done, root), errors
@@ -0,0 +1,259 @@
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+import profiling
+from metrics_core import _matrix, moments
+
+# Хвостовые риски (VaR / ES) по матрице доходностей (бары x стратегии).
+# Замена пакета var: все колонки считаются сразу, хвост выбирается
+# частичной сортировкой np.partition, а не полной сортировкой колонки.
+# Определения - как в var (methods.historic и VaR.backtest(method='h')),
+# на них посчитан sl_cvar.xlsx:
+#   VaR - np.percentile(r, 100 * (1 - level), method='lower')
+#   ES  - среднее доходностей строго ниже VaR (нет таких - сам VaR)
+#   прогноз - окно из window баров, до последнего бара истории (не включая
+#   его); прогноз окна действует с бара через lag после конца окна
+# Убытки - отрицательные доходности. Пропуски (NaN) в выборке игнорируются.
+
+LEVELS = (0.95, 0.975, 0.99)
+
+# Окно истории для rolling VaR/ES и бектеста пробитий (var.backtest: window=250)
+DEFAULT_WINDOW = 250
+
+# Сдвиг прогноза после конца окна (var.backtest: pd.DateOffset(1))
+DEFAULT_LAG = '1D'
+
+# Узлы для интегрирования квантиля Корниша-Фишера по хвосту (ES)
+_ES_NODES = 64
+
+_NORMAL = NormalDist()
+
+
+def _level_label(level):
+    # 0.975 -> '97,5', 0.95 -> '95' (как в заголовках sl_cvar.xlsx)
+    return f'{level * 100:g}'.replace('.', ',')
+
+
+def _var_positions(count, level):
+    # Позиция VaR в отсортированной выборке: виртуальный индекс
+    # np.percentile(method='lower') для q = 100 - level * 100, той же арифметикой
+    q = (100 - level * 100) / 100
+    virtual = count * q + (1 - q) - 1
+    return np.clip(np.floor(virtual).astype(np.int64), 0, np.maximum(count - 1, 0))
+
+
+def _tail_stats(values, count, levels):
+    """
+    VaR и ES по последней оси values для нескольких уровней.
+
+    values - (..., w) с NaN на месте пропусков, count - (...) число
+    наблюдений. Берутся m наименьших (m - позиция VaR самого высокого
+    уровня + 1) через np.partition, сортируются только они.
+    """
+    positions = [_var_positions(count, level) for level in levels]
+    m = int(max(position.max() for position in positions)) + 1 if count.size else 0
+    shape = count.shape
+    if m == 0 or values.shape[-1] == 0:
+        empty = np.full((len(levels),) + shape, np.nan)
+        return empty, empty.copy()
+    filled = np.where(np.isnan(values), np.inf, values)
+    smallest = np.sort(np.partition(filled, m - 1, axis=-1)[..., :m], axis=-1)
+    cumulative = np.cumsum(np.where(np.isinf(smallest), 0.0, smallest), axis=-1)
+    var = np.empty((len(levels),) + shape)
+    es = np.empty((len(levels),) + shape)
+    for i, position in enumerate(positions):
+        var[i] = np.take_along_axis(smallest, position[..., None], axis=-1)[..., 0]
+        # Хвост - наблюдения строго ниже VaR (все они среди первых position)
+        below = (smallest < var[i][..., None]).sum(axis=-1)
+        total = np.take_along_axis(cumulative, np.maximum(below - 1, 0)[..., None], axis=-1)[..., 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            es[i] = np.where(below > 0, total / below, var[i])
+    empty = count == 0
+    var[:, empty] = np.nan
+    es[:, empty] = np.nan
+    return var, es
+
+
+def historical(returns, levels=LEVELS):
+    """
+    Исторические VaR и ES по всей истории каждой колонки.
+    Возвращает два DataFrame (уровни x стратегии).
+    """
+    values = _matrix(returns)
+    count = (~np.isnan(values)).sum(axis=0)
+    var, es = _tail_stats(values.T, count, levels)
+    columns = getattr(returns, 'columns', None)
+    return (pd.DataFrame(var, index=list(levels), columns=columns),
+            pd.DataFrame(es, index=list(levels), columns=columns))
+
+
+def _higher_moments(values, stats):
+    # Смещенные skew и избыточный kurtosis, как scipy.stats.skew / kurtosis по умолчанию
+    count, mean, _ = stats
+    valid = ~np.isnan(values)
+    centered = np.where(valid, values - mean, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        m2 = (centered ** 2).sum(axis=0) / count
+        m3 = (centered ** 3).sum(axis=0) / count
+        m4 = (centered ** 4).sum(axis=0) / count
+        return m3 / m2 ** 1.5, m4 / m2 ** 2 - 3
+
+
+def _cornish_fisher(z, skew, kurt):
+    return (z + (z ** 2 - 1) * skew / 6 + (z ** 3 - 3 * z) * kurt / 24
+            - (2 * z ** 3 - 5 * z) * skew ** 2 / 36)
+
+
+def parametric(returns, levels=LEVELS, method='normal'):
+    """
+    Параметрические VaR и ES: method='normal' или 'cornish-fisher'
+    (поправка квантиля на skew и kurtosis колонки).
+    Возвращает два DataFrame (уровни x стратегии).
+    """
+    if method not in ('normal', 'cornish-fisher'):
+        raise ValueError(f'Unknown method: {method}')
+    values = _matrix(returns)
+    stats = moments(values)
+    _, mean, std = stats
+    if method == 'cornish-fisher':
+        skew, kurt = _higher_moments(values, stats)
+
+    var = np.empty((len(levels), values.shape[1]))
+    es = np.empty_like(var)
+    for i, level in enumerate(levels):
+        alpha = 1 - level
+        z = _NORMAL.inv_cdf(alpha)
+        if method == 'normal':
+            var[i] = mean + std * z
+            es[i] = mean - std * _NORMAL.pdf(z) / alpha
+        else:
+            var[i] = mean + std * _cornish_fisher(z, skew, kurt)
+            # ES - среднее квантиля по хвосту (0, alpha), метод средних точек
+            nodes = np.array([_NORMAL.inv_cdf(alpha * (j + 0.5) / _ES_NODES) for j in range(_ES_NODES)])
+            tail = _cornish_fisher(nodes[:, None], skew, kurt).mean(axis=0)
+            es[i] = mean + std * tail
+    columns = getattr(returns, 'columns', None)
+    return (pd.DataFrame(var, index=list(levels), columns=columns),
+            pd.DataFrame(es, index=list(levels), columns=columns))
+
+
+def rolling(returns, window=DEFAULT_WINDOW, levels=LEVELS, lag=DEFAULT_LAG, chunk_size=None):
+    """
+    Прогноз исторических VaR и ES на каждый бар, как VaR.backtest(method='h'):
+    окна из window баров, кончающиеся на барах window-1 .. n-2; прогноз окна
+    действует с бара, отстоящего от конца окна на lag (по времени индекса),
+    до прогноза следующего окна. lag=None - со следующего бара.
+
+    Возвращает словари {level: DataFrame} для VaR и ES, выровненные по
+    индексу returns; бары без прогноза - NaN. Окна обрабатываются
+    блоками по chunk_size баров, чтобы ограничить память.
+    """
+    values = _matrix(returns)
+    n, k = values.shape
+    var = np.full((len(levels), n, k), np.nan)
+    es = np.full((len(levels), n, k), np.nan)
+    if n > window:
+        # Статистики окон по концу окна: stats[:, j] - окно [j, j + window)
+        valid = np.vstack([np.zeros((1, k), dtype=np.int64), np.cumsum(~np.isnan(values), axis=0)])
+        windows = np.lib.stride_tricks.sliding_window_view(values[:-1], window, axis=0)  # (n - window, k, window)
+        var_windows = np.empty((len(levels), n - window, k))
+        es_windows = np.empty((len(levels), n - window, k))
+        if chunk_size is None:
+            # ~16M элементов на блок
+            chunk_size = max(1, (1 << 24) // max(1, k * window))
+        for start in range(0, n - window, chunk_size):
+            stop = min(n - window, start + chunk_size)
+            count = valid[start + window:stop + window] - valid[start:stop]
+            var_windows[:, start:stop], es_windows[:, start:stop] = _tail_stats(windows[start:stop], count, levels)
+
+        # Для каждого бара - последнее окно, прогноз которого уже действует
+        if lag is None:
+            source = np.arange(n) - window
+        else:
+            index = pd.DatetimeIndex(returns.index)
+            ready = index[window - 1:n - 1] + pd.Timedelta(lag)
+            source = ready.searchsorted(index, side='right') - 1
+        has = source >= 0
+        var[:, has] = var_windows[:, source[has]]
+        es[:, has] = es_windows[:, source[has]]
+
+    index = getattr(returns, 'index', None)
+    columns = getattr(returns, 'columns', None)
+    return ({level: pd.DataFrame(var[i], index=index, columns=columns) for i, level in enumerate(levels)},
+            {level: pd.DataFrame(es[i], index=index, columns=columns) for i, level in enumerate(levels)})
+
+
+def breaches(returns, window=DEFAULT_WINDOW, level=0.95, measure='es', lag=DEFAULT_LAG):
+    """
+    Бектест: сколько раз доходность бара оказалась ниже прогноза
+    rolling VaR/ES. Возвращает (пробития, проверенные бары).
+    """
+    var, es = rolling(returns, window, (level,), lag)
+    forecast = (es if measure == 'es' else var)[level].to_numpy()
+    values = _matrix(returns)
+    tested = ~np.isnan(forecast) & ~np.isnan(values)
+    hits = (values < forecast) & tested
+    return hits.sum(axis=0), tested.sum(axis=0)
+
+
+@profiling.profiled('cvar')
+def tail_risk_table(returns, levels=LEVELS, window=DEFAULT_WINDOW, lag=DEFAULT_LAG, formatted=True):
+    """
+    Таблица хвостовых рисков в формате sl_cvar.xlsx: прогноз CVaR на
+    последний бар на каждом уровне, частота и количество пробитий
+    CVaR первого уровня на истории (как VaR.backtest / evaluate).
+    formatted=False - числа вместо строк вида '-0.687 %' / '2.67%'.
+    """
+    _, es = rolling(returns, window, levels, lag)
+    values = _matrix(returns)
+    forecast = es[levels[0]].to_numpy()
+    tested = ~np.isnan(forecast) & ~np.isnan(values)
+    hits = ((values < forecast) & tested).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frequency = hits / tested.sum(axis=0)
+
+    table = {'Актив': list(returns.columns)}
+    for level in levels:
+        column = es[level].to_numpy()[-1] * 100 if len(values) else np.full(values.shape[1], np.nan)
+        table[f'CVaR ({_level_label(level)}%) Historic'] = (
+            [f'{v:.3f} %' for v in column] if formatted else column)
+    label = f'Частота превышений на истории CVaR ({_level_label(levels[0])}%)'
+    table[label] = [f'{v:.2%}' for v in frequency] if formatted else frequency
+    table['Количество пробитий на истории'] = hits
+    return pd.DataFrame(table)
+
+
+def check_excel(returns_path='sl_returns.xlsx', cvar_path='sl_cvar.xlsx'):
+    """
+    Сверка tail_risk_table с сохраненной таблицей var: пересчет по
+    sl_returns.xlsx и сравнение строк sl_cvar.xlsx. Возвращает список расхождений.
+    """
+    returns = pd.read_excel(returns_path).set_index('time')
+    returns = returns.drop(columns=[c for c in ['Unnamed: 0'] if c in returns.columns])
+    expected = pd.read_excel(cvar_path)
+    expected = expected.drop(columns=[c for c in ['Unnamed: 0'] if c in expected.columns])
+    actual = tail_risk_table(returns[list(expected['Актив'])])
+    mismatches = []
+    for column in expected.columns:
+        for asset, old, new in zip(expected['Актив'], expected[column], actual[column]):
+            if str(old) != str(new):
+                mismatches.append(f'{asset} / {column}: {old} != {new}')
+    return mismatches
+
+
+if __name__ == '__main__':
+    # python tail_risk.py [root] - пересчет таблицы sl_cvar по доходностям из хранилища
+    # python tail_risk.py --check - сверка с sl_cvar.xlsx (код выхода 1 при расхождении)
+    import sys
+    import results_store
+
+    if sys.argv[1:] == ['--check']:
+        mismatches = check_excel()
+        for mismatch in mismatches:
+            print(mismatch)
+        print(f'{len(mismatches)} mismatches')
+        sys.exit(1 if mismatches else 0)
+    root = sys.argv[1] if len(sys.argv) > 1 else results_store.DEFAULT_ROOT
+    results_store.write_tail_risk(tail_risk_table(results_store.load_returns(root=root)), root)
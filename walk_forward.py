@@ -0,0 +1,236 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from backtester import run_grid
+from metrics_core import _matrix, benchmark_rates, resolve_benchmarks, resolve_periods
+from rolling_metrics import WindowMoments, _prefix
+
+# Walk-forward оптимизация: на каждом in-sample окне выбирается лучшая
+# конфигурация (strategy_type, deviation, rebalance_hours, start_hour) по
+# метрике calculate_metrics, и она применяется на следующем out-of-sample
+# отрезке. OOS-отрезки склеиваются в одну кривую капитала.
+#
+# Каждая конфигурация прогоняется один раз по всей истории (run_grid);
+# метрики окон берутся из префиксных сумм по матрице доходностей, а не
+# повторным run_strategy на каждом окне. Поэтому позиция на OOS-отрезке -
+# та, что была бы при работе выбранной конфигурации с начала истории
+# (смена конфигурации не стоит комиссий).
+
+# Метрики, которые считаются по префиксным суммам; остальные - calculate_metrics по срезу окна
+_RATE_METRIC = re.compile(r'^(Sharpe|Sortino) Ratio \((.+)\)$')
+PREFIX_METRICS = ['Volatility (ann)', 'Max Drawdown', 'Total Return']
+
+# Метрики, где лучше меньшее значение
+LOWER_IS_BETTER = {'Volatility (ann)', 'Max Drawdown'}
+
+
+def _position(index, value):
+    # Позиция первого бара не раньше value (число - позиция как есть)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return int(index.searchsorted(pd.Timestamp(value), side='left'))
+
+
+def _offset(index, start, length):
+    # Позиция бара через length после бара start: число баров или смещение ('30D')
+    if isinstance(length, (int, np.integer)):
+        return start + int(length)
+    if start >= len(index):
+        return len(index)
+    return int(index.searchsorted(index[start] + pd.Timedelta(length), side='left'))
+
+
+def walk_forward_windows(index, train='90D', test='30D', anchored=False, start=None):
+    """
+    Окна walk-forward: список (train_start, train_end, test_end) позиций баров,
+    in-sample [train_start, train_end), out-of-sample [train_end, test_end).
+
+    train, test - число баров или смещение по времени ('90D', '30D')
+    anchored    - in-sample всегда от начала истории (expanding)
+    start       - начало первого in-sample окна (позиция или дата)
+    """
+    index = pd.DatetimeIndex(index)
+    first = 0 if start is None else _position(index, start)
+    n = len(index)
+    windows = []
+    train_start = first
+    train_end = _offset(index, first, train)
+    while train_end < n:
+        test_end = min(n, _offset(index, train_end, test))
+        if test_end <= train_end:
+            break
+        windows.append((first if anchored else train_start, train_end, test_end))
+        train_start = _offset(index, train_start, test) if not anchored else first
+        train_end = test_end
+    return windows
+
+
+class WindowScorer:
+    """
+    Метрика calculate_metrics для всех стратегий на произвольных окнах [s, e).
+
+    Префиксные суммы по матрице доходностей считаются один раз при создании,
+    дальше метрика окна - O(k) для Sharpe / Sortino / волатильности /
+    полной доходности и O(длина окна * k) для максимальной просадки.
+    Остальные метрики - calculate_metrics по срезу окна.
+    """
+
+    def __init__(self, returns, metric='Sharpe Ratio (US Treasury)', risk_free_rate=None,
+                 benchmarks=None, periods=None):
+        self.returns = returns.sort_index()
+        self.metric = metric
+        self.risk_free_rate = risk_free_rate
+        self.benchmarks = benchmarks
+        self.periods = resolve_periods(periods, self.returns.index)
+        values = _matrix(self.returns)
+        valid = ~np.isnan(values)
+
+        match = _RATE_METRIC.match(metric)
+        self.kind = match.group(1).lower() if match else metric if metric in PREFIX_METRICS else None
+        if self.kind in ('sharpe', 'sortino'):
+            benchmarks = resolve_benchmarks(benchmarks, risk_free_rate)
+            name = match.group(2)
+            if name not in benchmarks:
+                raise ValueError(f"Unknown benchmark '{name}' in metric '{metric}'")
+            # Избыточная доходность r - c / periods; ставка постоянная или по барам
+            rate = benchmark_rates({name: benchmarks[name]}, self.returns.index)
+            values = values - np.reshape(rate, (1, -1) if rate.ndim == 1 else (-1, 1)) / self.periods
+
+        self.count = _prefix(valid.astype(np.float64))
+        if self.kind in ('sharpe', 'sortino', 'Volatility (ann)'):
+            self.moments = WindowMoments(values)
+            if self.kind == 'sortino':
+                self.d2 = _prefix(np.where(valid, np.minimum(0, values), 0.0) ** 2)
+        elif self.kind == 'Total Return':
+            self.log_wealth = _prefix(np.log1p(np.nan_to_num(values, nan=0.0)))
+        elif self.kind == 'Max Drawdown':
+            self.wealth = np.cumprod(1 + np.nan_to_num(values, nan=0.0), axis=0)
+
+    def score(self, start, end):
+        """Метрика окна [start, end) для каждой стратегии: массив (k,)."""
+        if self.kind is None:
+            from strategy_analytics_v2 import calculate_metrics
+
+            table = calculate_metrics(self.returns.iloc[start:end], risk_free_rate=self.risk_free_rate,
+                                      periods=self.periods, benchmarks=self.benchmarks)
+            if self.metric not in table.columns:
+                raise ValueError(f"Unknown metric '{self.metric}'")
+            return table[self.metric].to_numpy(dtype=np.float64)
+
+        count = self.count[end] - self.count[start]
+        # Как min_periods в rolling_metrics: меньше двух наблюдений - NaN
+        return np.where(count >= 2, self._window_score(start, end, count), np.nan)
+
+    def _window_score(self, start, end, count):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if self.kind == 'Total Return':
+                return np.expm1(self.log_wealth[end] - self.log_wealth[start])
+            if self.kind == 'Max Drawdown':
+                if end <= start:
+                    return np.full(self.wealth.shape[1], np.nan)
+                # Просадка не зависит от масштаба капитала: глобальная кривая вместо пересчета окна
+                window = self.wealth[start:end]
+                peak = np.maximum.accumulate(window, axis=0)
+                return ((peak - window) / peak).max(axis=0)
+
+            _, mean, std = self.moments(start, end)
+            if self.kind == 'Volatility (ann)':
+                return std * np.sqrt(self.periods)
+            if self.kind == 'sharpe':
+                return np.sqrt(self.periods) * mean / std
+            downside = np.sqrt((self.d2[end] - self.d2[start]) / count) * np.sqrt(self.periods)
+            return np.where(downside != 0, mean * self.periods / downside, np.nan)
+
+
+def walk_forward_returns(returns, metric='Sharpe Ratio (US Treasury)', train='90D', test='30D',
+                         anchored=False, start=None, ascending=None, risk_free_rate=None,
+                         benchmarks=None, periods=None):
+    """
+    Walk-forward по готовой матрице доходностей конфигураций (например run_grid).
+
+    ascending - True, если лучше меньшее значение метрики (по умолчанию
+                для 'Max Drawdown' и 'Volatility (ann)')
+
+    Возвращает (oos, selections):
+    oos        - DataFrame по барам OOS-отрезков: strategy_ret выбранной
+                 конфигурации, config и strategy_cumret (склеенная кривая)
+    selections - DataFrame по окнам: границы, выбранная конфигурация и ее метрика in-sample
+    """
+    returns = returns.sort_index()
+    if ascending is None:
+        ascending = metric in LOWER_IS_BETTER
+    scorer = WindowScorer(returns, metric, risk_free_rate, benchmarks, periods)
+    values = _matrix(returns)
+    index = returns.index
+    columns = list(returns.columns)
+
+    rows = []
+    pieces = []
+    chosen = []
+    for train_start, train_end, test_end in walk_forward_windows(index, train, test, anchored, start):
+        scores = scorer.score(train_start, train_end)
+        if np.isnan(scores).all():
+            continue
+        best = int(np.nanargmin(scores) if ascending else np.nanargmax(scores))
+        rows.append({
+            'train_start': index[train_start],
+            'train_end': index[train_end - 1],
+            'test_start': index[train_end],
+            'test_end': index[test_end - 1],
+            'config': columns[best],
+            'score': scores[best],
+        })
+        pieces.append(np.arange(train_end, test_end))
+        chosen.append(np.full(test_end - train_end, best, dtype=np.int64))
+
+    positions = np.concatenate(pieces) if pieces else np.empty(0, dtype=np.int64)
+    chosen = np.concatenate(chosen) if chosen else np.empty(0, dtype=np.int64)
+    strategy_ret = values[positions, chosen]
+    oos = pd.DataFrame({
+        'strategy_ret': strategy_ret,
+        'config': [columns[j] for j in chosen],
+        'strategy_cumret': np.cumprod(1 + np.nan_to_num(strategy_ret, nan=0.0)),
+    }, index=index[positions])
+    return oos, pd.DataFrame(rows, columns=['train_start', 'train_end', 'test_start', 'test_end', 'config', 'score'])
+
+
+def walk_forward(
+    data,
+    grid,
+    lst_token,
+    lst_token_ret,
+    hedge_token,
+    hedge_token_ret,
+    cross_token,
+    funding_type,
+    init_capital,
+    fut_fees,
+    spot_fees,
+    lst_collateral=1,
+    cross_ex=0,
+    metric='Sharpe Ratio (US Treasury)',
+    train='90D',
+    test='30D',
+    anchored=False,
+    ascending=None,
+    risk_free_rate=None,
+    benchmarks=None,
+    periods=None,
+):
+    """
+    Walk-forward оптимизация по сетке run_grid: grid - словарь списков
+    strategy_type / deviation / rebalance_hours / start_hour (см. expand_grid).
+
+    Все конфигурации прогоняются один раз по всей истории, дальше
+    выбор на окнах - walk_forward_returns (его же можно вызвать напрямую
+    по готовому run_grid, чтобы перебрать метрики и окна без новых прогонов).
+    """
+    returns = run_grid(data, grid, lst_token, lst_token_ret, hedge_token, hedge_token_ret,
+                       cross_token, funding_type, init_capital, fut_fees, spot_fees,
+                       lst_collateral=lst_collateral, cross_ex=cross_ex)
+    oos, selections = walk_forward_returns(returns, metric, train, test, anchored, None, ascending,
+                                           risk_free_rate, benchmarks, periods)
+    oos['capital'] = init_capital * oos['strategy_cumret']
+    return oos, selections